@@ -1,14 +1,24 @@
 import requests
 from pydantic import BaseModel
 from typing import List, Optional
+import hashlib
+import json
 import os
 import re
 import imaplib
+import logging
 import time
 import email
 from email.header import decode_header
-from dotenv import load_dotenv
-load_dotenv()
+from utils.shared_cache import shared_cache
+from utils.tenants import get_tenant
+
+
+log = logging.getLogger(__name__)
+
+# Seconds allowed for each CRM call and for the OTP email to arrive
+CRM_TIMEOUT = 30
+OTP_TIMEOUT = int(os.getenv("CRM_OTP_TIMEOUT", 2 * 60))
 
 
 class Provider(BaseModel):
@@ -29,19 +39,20 @@ class Licenses(BaseModel):
     state: str
 
 
-def get_crm_auth_token():
-    print("Logging in to CRM...")
+def get_crm_auth_token(tenant=None):
+    tenant = tenant or get_tenant()
+    log.info("Logging in to CRM", extra={"tenant": tenant.id})
     loginResponse = requests.post("https://api.licentiam.com/api/admin/auth/login", json={
         "data": {
-            "email": os.getenv("CRM_EMAIL"),
-            "password": os.getenv("CRM_PASSWORD")
+            "email": tenant.env("CRM_EMAIL"),
+            "password": tenant.env("CRM_PASSWORD")
         }
-    })
+    }, timeout=CRM_TIMEOUT)
 
     device_token = loginResponse.json(
     )["errors"][0]["metadata"]["device_token"]
 
-    print("Sending OTP request...")
+    log.info("Requesting CRM OTP email")
 
     requests.post("https://api.licentiam.com/api/admin/verification/code", json={
         "data": {
@@ -50,14 +61,17 @@ def get_crm_auth_token():
     },
         headers={
         "Devicetoken": f"Bearer {device_token}"
-    })
+    }, timeout=CRM_TIMEOUT)
 
     OTP = None
+    deadline = time.monotonic() + OTP_TIMEOUT
 
     while OTP is None:
-        print("Waiting for OTP...")
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"No CRM OTP email arrived within {OTP_TIMEOUT}s")
+        log.debug("Waiting for CRM OTP email")
         time.sleep(5)
-        OTP = get_crm_mail_otp()
+        OTP = get_crm_mail_otp(tenant)
 
     deviceResponse = requests.post("https://api.licentiam.com/api/admin/verification/device", json={
         "data": {
@@ -66,20 +80,62 @@ def get_crm_auth_token():
     },
         headers={
         "Devicetoken": f"Bearer {device_token}"
-    })
+    }, timeout=CRM_TIMEOUT)
 
     authToken = deviceResponse.json()["data"]["auth_token"]
 
-    print(authToken)
+    log.info("CRM login succeeded", extra={"tenant": tenant.id})
 
     return authToken
 
 
-def get_crm_mail_otp():
+LIST_USERS_QUERY = """
+query ListUsers($page: Int!, $perPage: Int!) {
+  users(page: $page, perPage: $perPage) {
+    id
+    email
+    userProfile {
+      npiNumber
+      __typename
+    }
+    __typename
+  }
+}
+"""
+
+
+def check_graphql_response(response, operation, authToken, tenant=None):
+    """Raises on an HTTP error or a GraphQL error, dropping the token if CRM rejected it."""
+    if response.status_code == 401:
+        invalidate_crm_auth_token(authToken, tenant)
+    response.raise_for_status()
+
+    body = response.json()
+    if body.get("errors"):
+        raise Exception(f"CRM {operation} failed: {body['errors'][0].get('message')}")
+    return body.get("data")
+
+
+def get_cached_crm_auth_token(tenant=None):
+    """Returns the tenant's CRM token shared by all workers, running the OTP login only when none is valid."""
+    tenant = tenant or get_tenant()
+    return shared_cache.single_flight(
+        f"crm_token:{tenant.id}", lambda: get_crm_auth_token(tenant),
+        ttl=int(os.getenv("CRM_TOKEN_TTL", 8 * 60 * 60)))
+
+
+def invalidate_crm_auth_token(authToken, tenant=None):
+    """Drops a rejected CRM token unless another worker already replaced it."""
+    tenant = tenant or get_tenant()
+    shared_cache.compare_and_set(f"crm_token:{tenant.id}", authToken, None)
+
+
+def get_crm_mail_otp(tenant=None):
+    tenant = tenant or get_tenant()
     OTP = None
     # Connect to the Gmail IMAP server
-    mail = imaplib.IMAP4_SSL("imap.gmail.com")
-    mail.login(os.getenv("CRM_EMAIL"), os.getenv("CRM_APP_PASSWORD"))
+    mail = imaplib.IMAP4_SSL("imap.gmail.com", timeout=CRM_TIMEOUT)
+    mail.login(tenant.env("CRM_EMAIL"), tenant.env("CRM_APP_PASSWORD"))
 
     # Select the mailbox you want to monitor (e.g., 'inbox')
     mail.select("inbox")
@@ -105,10 +161,9 @@ def get_crm_mail_otp():
                 # Decode the sender's email address
                 from_ = msg.get("From")
 
-                print("Found Mail:", subject, from_)
-                print("="*50)
-
                 if subject != "Your Licentiam verification code." or from_ != "Licentiam <contact@licentiam.com>":
+                    # Unrelated mail in the inbox, not worth logging beyond a count
+                    log.debug("Skipped unrelated email while waiting for OTP", extra={"sample_rate": 0.01})
                     break
 
                 # Extract email body
@@ -128,7 +183,7 @@ def get_crm_mail_otp():
                 OTP = otp_match.group()
 
                 if OTP:
-                    print("Found OTP:", OTP)
+                    log.info("Found CRM OTP email")
 
     # Close the connection and logout
     mail.close()
@@ -138,12 +193,14 @@ def get_crm_mail_otp():
 
 
 if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
     get_crm_auth_token()
 
 
-def add_provider(provider: Provider, authToken: str):
+def add_provider(provider: Provider, authToken: str, tenant=None):
     if not authToken:
-        authToken = get_crm_auth_token()
+        authToken = get_cached_crm_auth_token(tenant)
 
     # GraphQL mutation payload
     payload = {
@@ -231,19 +288,28 @@ def add_provider(provider: Provider, authToken: str):
     }
 
     response = requests.post(
-        "https://api.licentiam.com/api/admin/graphql", json=payload, headers=headers)
+        "https://api.licentiam.com/api/admin/graphql", json=payload, headers=headers, timeout=CRM_TIMEOUT)
 
+    if response.status_code == 401:
+        invalidate_crm_auth_token(authToken, tenant)
     response.raise_for_status()
     
     try:
       userId = response.json()["data"]["addUser"]["user"]["id"]
-      print("Provider added successfully!")
+      log.info("Provider added", extra={"userId": userId})
     except:
-      print("Error adding provider!")
-      print("Error:", response.json()["errors"][0]["message"])
-      raise Exception(response.json()["errors"][0]["message"])
+      message = response.json()["errors"][0]["message"]
+      log.error("Adding provider failed: %s", message)
+      raise Exception(message)
 
-    requests.post("https://api.licentiam.com/api/admin/graphql", json={
+    return userId
+
+
+def update_user_profile(userId: str, provider: Provider, authToken: str, tenant=None):
+    if not authToken:
+        authToken = get_cached_crm_auth_token(tenant)
+
+    response = requests.post("https://api.licentiam.com/api/admin/graphql", json={
         "operationName": "UpdateUserProfile",
         "variables": {
             "userId": userId,
@@ -298,15 +364,171 @@ def add_provider(provider: Provider, authToken: str):
     },
         headers={"Authorization": f"Bearer {authToken}",
                  "Content-Type": "application/json"
-                 })
+                 },
+        timeout=CRM_TIMEOUT)
+
+    check_graphql_response(response, "UpdateUserProfile", authToken, tenant)
 
     return userId
 
 
-def upload_licenses(userId: str, licenses: List[Licenses], authToken: str):
+def user_index_keys(email=None, npi=None, tenant=None):
+    tenant = tenant or get_tenant()
+    keys = []
+    if email:
+        keys.append(f"crm_index:{tenant.id}:email:{email.lower()}")
+    if npi:
+        keys.append(f"crm_index:{tenant.id}:npi:{npi}")
+    return keys
+
+
+def lookup_user(email=None, npi=None, tenant=None):
+    """Returns the CRM user id indexed under the email or NPI, if any."""
+    for key in user_index_keys(email, npi, tenant):
+        userId = shared_cache.get(key)
+        if userId:
+            return userId
+    return None
+
+
+def index_user(userId: str, email=None, npi=None, tenant=None):
+    shared_cache.set_many({key: userId for key in user_index_keys(email, npi, tenant)},
+                          ttl=int(os.getenv("CRM_INDEX_TTL", 24 * 60 * 60)))
+
+
+def user_index_needs_sync(tenant=None):
+    """True unless a worker synced the index recently, or a sync failed and is backing off."""
+    tenant = tenant or get_tenant()
+    return (shared_cache.get(f"crm_index:{tenant.id}:synced_at") is None
+            and shared_cache.get(f"crm_index:{tenant.id}:failed_at") is None)
 
+
+def sync_user_index(authToken: str, tenant=None, page_size: int = 500):
+    """Pages through every CRM user and indexes them by email and NPI.
+
+    A failed sync is remembered for CRM_INDEX_RETRY seconds, so requests
+    don't each start another sync that is bound to fail the same way.
+    """
+    tenant = tenant or get_tenant()
+    try:
+        return _sync_user_index(authToken, tenant, page_size)
+    except Exception:
+        shared_cache.set(f"crm_index:{tenant.id}:failed_at", time.time(),
+                         ttl=int(os.getenv("CRM_INDEX_RETRY", 15 * 60)))
+        raise
+
+
+def _sync_user_index(authToken, tenant, page_size):
     if not authToken:
-        authToken = get_crm_auth_token()
+        authToken = get_cached_crm_auth_token(tenant)
+
+    ttl = int(os.getenv("CRM_INDEX_TTL", 24 * 60 * 60))
+    page = 1
+    total = 0
+    seen = set()
+    while True:
+        response = requests.post("https://api.licentiam.com/api/admin/graphql", json={
+            "operationName": "ListUsers",
+            "variables": {
+                "page": page,
+                "perPage": page_size,
+            },
+            "query": LIST_USERS_QUERY,
+        },
+            headers={"Authorization": f"Bearer {authToken}",
+                     "Content-Type": "application/json"
+                     },
+            timeout=CRM_TIMEOUT)
+
+        data = check_graphql_response(response, "ListUsers", authToken, tenant)
+        users = (data or {}).get("users")
+        if users is None:
+            raise Exception("CRM ListUsers response has no users field, the query may not match the schema")
+
+        # The server may cap perPage below page_size, so only an empty page,
+        # or one that repeats users already seen, means the end
+        fresh = [user for user in users if user["id"] not in seen]
+        if not fresh:
+            break
+        seen.update(user["id"] for user in fresh)
+
+        entries = {}
+        for user in fresh:
+            npi = (user.get("userProfile") or {}).get("npiNumber")
+            for key in user_index_keys(user.get("email"), npi, tenant):
+                entries[key] = user["id"]
+        shared_cache.set_many(entries, ttl=ttl)
+
+        total += len(fresh)
+        page += 1
+
+    shared_cache.set(f"crm_index:{tenant.id}:synced_at", time.time(), ttl=ttl)
+    log.info("Indexed %d CRM users", total, extra={"tenant": tenant.id})
+    return total
+
+
+def write_fingerprint(provider: Provider, licenses: List[Licenses]):
+    """Hashes everything a submit writes, so only an identical resubmit counts as a duplicate."""
+    payload = json.dumps([provider.model_dump(), [license.model_dump() for license in licenses]], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def write_provider(provider: Provider, licenses: List[Licenses], authToken: str, tenant=None):
+    """Adds or updates the provider and uploads their licenses, once per identical submit.
+
+    Writes for the same email are serialised by a lease, so a concurrent
+    duplicate waits for the first run. It is marked as written only after
+    every CRM call succeeded. A half-created user is resumed rather than
+    rolled back: it stays marked as pending from AddUser until its licenses
+    are uploaded, and a retry finishes the profile update and upload
+    instead of taking the update path, which never uploads.
+
+    Returns the CRM user id and the action taken: "created", "updated", or
+    "duplicate" when an identical submit already completed.
+    """
+    tenant = tenant or get_tenant()
+    email = provider.email.lower()
+    marker = f"crm_write:{tenant.id}:{write_fingerprint(provider, licenses)}"
+    pending = f"crm_pending:{tenant.id}:{email}"
+    with shared_cache.lease(f"crm:{tenant.id}:{email}"):
+        written = shared_cache.get(marker)
+        if written:
+            log.info("Provider was written by an identical earlier submit", extra={"userId": written["userId"]})
+            return written["userId"], "duplicate"
+
+        userId = shared_cache.get(pending)
+        if userId:
+            log.info("Finishing a provider whose licenses were never uploaded", extra={"userId": userId})
+            update_user_profile(userId, provider, authToken, tenant)
+            action = "created"
+        elif userId := lookup_user(email=email, npi=provider.npi, tenant=tenant):
+            # BatchCreateLicenses always appends, so uploading again would
+            # give an existing user another full copy of their licenses
+            log.info("Provider already exists, updating their profile only", extra={"userId": userId})
+            update_user_profile(userId, provider, authToken, tenant)
+            action = "updated"
+        else:
+            userId = add_provider(provider, authToken, tenant)
+            shared_cache.set(pending, userId, ttl=int(os.getenv("CRM_PENDING_TTL", 30 * 24 * 60 * 60)))
+            update_user_profile(userId, provider, authToken, tenant)
+            action = "created"
+
+        # Keep the index current with our own writes, even if the upload fails
+        index_user(userId, email=email, npi=provider.npi, tenant=tenant)
+
+        if action == "created":
+            upload_licenses(userId, licenses, authToken, tenant)
+            shared_cache.delete(pending)
+
+        shared_cache.set(marker, {"userId": userId, "action": action},
+                         ttl=int(os.getenv("CRM_WRITE_TTL", 10 * 60)))
+        return userId, action
+
+
+def upload_licenses(userId: str, licenses: List[Licenses], authToken: str, tenant=None):
+
+    if not authToken:
+        authToken = get_cached_crm_auth_token(tenant)
 
     response = requests.post("https://api.licentiam.com/api/admin/graphql", json={
         "operationName": "BatchCreateLicenses",
@@ -326,8 +548,9 @@ def upload_licenses(userId: str, licenses: List[Licenses], authToken: str):
     },
         headers={"Authorization": f"Bearer {authToken}",
                  "Content-Type": "application/json"
-                 })
+                 },
+        timeout=CRM_TIMEOUT)
 
-    response.raise_for_status()
+    check_graphql_response(response, "BatchCreateLicenses", authToken, tenant)
 
     return True
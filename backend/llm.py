@@ -1,11 +1,8 @@
-from openai import OpenAI
 from pydantic import BaseModel
 from typing import List, Optional
 import json
 from dateutil import parser
 from datetime import timezone
-from dotenv import load_dotenv
-load_dotenv()
 
 def parse_to_iso8601(date_str):
     try:
@@ -85,21 +82,31 @@ The data includes:
 - The `rows` list should support multiple licenses if they exist in the data.
 """
 
-client = OpenAI()
+client = None
 
 
-def create_sheet(context: str, birthDate: str):
+def get_client():
+    """Builds the OpenAI client on first use instead of at import."""
+    global client
+    if client is None:
+        from openai import OpenAI
+        client = OpenAI()
+    return client
+
+
+def create_sheet(context: str, birthDate: str, timeout: Optional[float] = None):
 
     messages = [
         {'role': "system", 'content': PROMPT_TEMPLATE},
         {'role': "user", 'content': context}
     ]
 
-    completion = client.beta.chat.completions.parse(
+    completion = get_client().beta.chat.completions.parse(
         model="gpt-4o",
         messages=messages,
         response_format=Response,
         temperature=0.0,
+        timeout=timeout,
     )
 
     response_data = completion.choices[0].message.parsed
@@ -1,24 +1,60 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+import time
+_import_started = time.perf_counter()
+
 from dotenv import load_dotenv
+
+# Load the environment once, before any module reads its settings
+load_dotenv()
+
+from utils.log import configure_logging, log_stats, stage, RequestIds
+
+# Route logs through the background writer before anything logs
+configure_logging()
+
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 import requests
-import uvicorn
+import hmac
+import logging
 import json
 import asyncio
 import os
+import sys
+import concurrent.futures
+import hashlib
 from datetime import datetime
-from utils.pdc import login_and_get_token, extract_text_from_pdf_bytes
-from llm import create_sheet
+from utils.pdc import get_pdc_token, invalidate_pdc_token, extract_text_from_pdf_file
+from utils.report_cache import report_cache_for
+from utils.shared_cache import shared_cache
+from utils.prefetch import prefetcher, index_syncs
+from utils.coalesce import stream_coalescer
+from utils.roster import RosterSnapshot, parse_roster
+from utils.deadline import RequestContext, Cancelled
+from utils.export import iter_export_rows, iter_csv, iter_xlsx, iter_until_disconnect
+from utils.tenants import Tenant, get_tenant, load_tenants
+from utils.scheduler import scheduler
+from utils.profiler import sampling_profiler, ProfiledRequests
+from utils.loop_monitor import loop_monitor
+from llm import create_sheet, get_client
 from pydantic import BaseModel
-from typing import Optional
-from crm import add_provider, upload_licenses, get_crm_auth_token, Provider, Licenses
+from typing import List, Literal, Optional, Union
+from crm import write_provider, get_cached_crm_auth_token, lookup_user, user_index_needs_sync, sync_user_index, Provider, Licenses
 
 
-load_dotenv()
+log = logging.getLogger("main")
 
 app = FastAPI()
 
+# Heavy dependencies that are imported lazily and warmed up after startup
+LAZY_MODULES = ("selenium.webdriver", "langchain_community.document_loaders", "openai")
+
+warmup = {"started": False, "done": False, "error": None}
+
+# Keys in the cross-worker cache are scoped by tenant, see utils/shared_cache.py
+ROSTER_TTL = int(os.getenv("ROSTER_TTL", 10 * 60))
+SHEET_TTL = int(os.getenv("SHEET_TTL", 7 * 24 * 60 * 60))
+
 # Enable CORS
 app.add_middleware(
     CORSMiddleware,
@@ -28,57 +64,197 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Counts finished requests while a profile is being taken
+app.add_middleware(ProfiledRequests, profiler=sampling_profiler)
+
+# Outermost, so the request id is set for everything below it
+app.add_middleware(RequestIds)
+
 
 @app.get("/")
 async def root():
     return {"message": "Welcome"}
 
 
-def change_name(data):
-    name = ""
-    if data['lastName']:
-        name += data['lastName'] + ', '
-    if data['firstName']:
-        name += data['firstName'] + ' '
-    if data['middleName']:
-        name += data['middleName']
-    if data['suffix']:
-        name += ', ' + data['suffix']
+def current_tenant(x_tenant: Optional[str] = Header(None)) -> Tenant:
+    """Selects the tenant from the X-Tenant header, falling back to the default tenant."""
+    try:
+        return get_tenant(x_tenant)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown tenant {x_tenant}.")
 
-    return name
 
+def roster_key(tenant):
+    return f"roster:{tenant.id}"
 
-@app.get("/get-roasters")
-async def get_roasters(token: Optional[str] = None):
-    """Fetches the roster list from FSMB API after login."""
 
-    if not token:
-        token = await asyncio.to_thread(login_and_get_token)
+def warm_up():
+    """Imports the lazy dependencies and builds clients so the first request doesn't pay for it."""
+    warmup["started"] = True
+    try:
+        import selenium.webdriver
+        import langchain_community.document_loaders
+        get_client()
+        # Filling the shared caches launches a browser login, so it is opt-in
+        if os.getenv("WARM_CACHES") == "1":
+            for tenant in load_tenants().values():
+                load_roasters(get_pdc_token(tenant), tenant)
+        warmup["done"] = True
+    except Exception as e:
+        log.exception("Warm-up failed")
+        warmup["error"] = str(e)
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    # Run in the background so readiness is not gated on warm-up
+    asyncio.get_running_loop().run_in_executor(None, warm_up)
+
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    if os.getenv("LOOP_LAG_MONITOR", "1") == "1":
+        loop_monitor.start()
+
+
+@app.get("/healthz")
+async def healthz():
+    """Reports readiness separately from the warm-up of lazy dependencies and caches."""
+    return {
+        "ready": True,
+        "import_seconds": round(IMPORT_SECONDS, 3),
+        "warmup": {
+            **warmup,
+            "modules": {name: name in sys.modules for name in LAZY_MODULES},
+            "caches": {
+                tenant.id: await asyncio.to_thread(
+                    shared_cache.status, [f"pdc_token:{tenant.id}", f"crm_token:{tenant.id}", roster_key(tenant)])
+                for tenant in load_tenants().values()
+            },
+        },
+        "logging": log_stats(),
+    }
 
-    if not token:
-        raise HTTPException(
-            status_code=401, detail="Failed to login and get token.")
 
-    URL = 'https://pdc-appapi.fsmb.org/roster/practitioner/list?pageSize=10000&pageIndex=0&customerId=7881'
+@app.get("/metrics")
+async def metrics():
+    """Reports upstream scheduling and report cache usage per tenant."""
+    scheduled = scheduler.metrics()
+    return {
+        tenant.id: {
+            "scheduler": scheduled.get(tenant.id, {}),
+            "report_cache": await asyncio.to_thread(report_cache_for(tenant).stats),
+        }
+        for tenant in load_tenants().values()
+    }
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Guards diagnostics endpoints, which are disabled unless ADMIN_TOKEN is set."""
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token or not x_admin_token or not hmac.compare_digest(x_admin_token, admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required.")
+
+
+@app.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def profile(
+    seconds: Optional[float] = None,
+    request_count: Optional[int] = Query(None, alias="requests"),
+    path: Optional[str] = None,
+):
+    """Samples all threads for N seconds, or until the next N requests finish, and returns collapsed stacks.
+
+    The output can be fed straight to flamegraph.pl or opened in speedscope.
+    """
+    if not seconds and not request_count:
+        seconds = 10
+
+    try:
+        collapsed, summary = await asyncio.to_thread(
+            sampling_profiler.profile, seconds, request_count, path)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    return PlainTextResponse(collapsed, headers={
+        "X-Profile-Samples": str(summary["samples"]),
+        "X-Profile-Seconds": str(summary["seconds"]),
+        "X-Profile-Requests": str(summary["requests"]),
+    })
+
+
+@app.get("/admin/loop-lag", dependencies=[Depends(require_admin)])
+async def loop_lag():
+    """Lists recent event-loop stalls with the coroutine and stack that caused them."""
+    return loop_monitor.report()
+
+
+def fetch_roasters(token, tenant, ctx=None):
+    URL = f'https://pdc-appapi.fsmb.org/roster/practitioner/list?pageSize=10000&pageIndex=0&customerId={tenant.customerId}'
     headers = {
         'Authorization': f'Bearer {token}',
         'Content-Type': 'application/json',
     }
 
-    # Make request to FSMB API
-    try:
-        response = requests.get(URL, headers=headers)
+    # Make request to FSMB API, parsing items as they stream in
+    timeout = ctx.timeout(cap=60, stage="roster download") if ctx else 60
+    with requests.get(URL, headers=headers, stream=True, timeout=timeout) as response:
         response.raise_for_status()
-        data = response.json()['items']
-        for i in data:
-            i['name'] = change_name(i)
-        return data
+        return parse_roster(response.iter_content(chunk_size=64 * 1024))
+
+
+def load_roasters(token, tenant, ctx=None):
+    """Returns the tenant's roster shared by all workers, downloading it in one of them at most."""
+    return shared_cache.single_flight(
+        roster_key(tenant), lambda: fetch_roasters(token, tenant, ctx), ttl=ROSTER_TTL,
+        loads=RosterSnapshot.from_columns, dumps=RosterSnapshot.to_columns, memo=True, ctx=ctx)
+
+
+async def get_roster_snapshot(tenant, token: Optional[str] = None, ctx=None):
+    """Returns the tenant's shared roster snapshot, logging in first if no token is given."""
+
+    if not token:
+        token = await asyncio.to_thread(get_pdc_token, tenant, ctx)
+
+    if not token:
+        raise HTTPException(
+            status_code=401, detail="Failed to login and get token.")
+
+    try:
+        return await asyncio.to_thread(load_roasters, token, tenant, ctx)
 
     except requests.exceptions.RequestException as e:
+        if getattr(e.response, "status_code", None) == 401:
+            invalidate_pdc_token(token, tenant)
         raise HTTPException(
             status_code=500, detail=f"Failed to fetch roasters: {e}")
 
 
+@app.get("/get-roasters")
+async def get_roasters(token: Optional[str] = None, tenant: Tenant = Depends(current_tenant)):
+    """Fetches the roster list from FSMB API after login."""
+    roasters = await get_roster_snapshot(tenant, token)
+    return [roster.to_dict() for roster in roasters]
+
+
+def parse_report(pdf_path, birth_date, tenant, ctx=None):
+    """Extracts and parses a cached report once, sharing the result across workers."""
+    def compute():
+        pdf_text = extract_text_from_pdf_file(pdf_path)
+        timeout = ctx.timeout(stage="license parsing") if ctx else None
+        return create_sheet(pdf_text, birth_date, timeout=timeout)
+
+    # Report blobs are content-addressed, so the file name is the PDF's hash
+    sha = os.path.splitext(os.path.basename(pdf_path))[0]
+    return shared_cache.single_flight(
+        f"sheet:{tenant.id}:{sha}:{birth_date}", compute, ttl=SHEET_TTL,
+        lease=ctx.timeout() if ctx else 300, ctx=ctx)
+
+
+def find_roaster(roasters, user):
+    """Finds the roster entry matching the user's name and birth date."""
+    return roasters.find(user.username, user.birth_date)
+
+
 class UserDetails(BaseModel):
     username: str
     birth_date: str
@@ -89,59 +265,131 @@ class UserDetails(BaseModel):
     crmToken: Optional[str] = None
 
 
+class PrefetchRequest(BaseModel):
+    rosterEntryId: Optional[Union[int, str]] = None
+    username: Optional[str] = None
+    birth_date: Optional[str] = None
+    pdcToken: Optional[str] = None
+    # A new prefetch from the same client supersedes its previous one
+    clientId: Optional[str] = None
+
+
+def prefetch_keys(tenant, roaster=None, user=None):
+    keys = []
+    if roaster is not None:
+        keys.append(f"{tenant.id}:roster:{roaster['rosterEntryId']}")
+    if user is not None and user.username and user.birth_date:
+        keys.append(f"{tenant.id}:user:{user.username}|{user.birth_date}")
+    return keys
+
+
+def prefetch_report(request: PrefetchRequest, tenant, ctx):
+    """Downloads and parses a practitioner's report so the caches are warm on submit."""
+    token = request.pdcToken or get_pdc_token(tenant, ctx)
+    roasters = load_roasters(token, tenant, ctx)
+
+    if request.rosterEntryId is not None:
+        roaster = roasters.get(request.rosterEntryId)
+    else:
+        roaster = find_roaster(roasters, request)
+
+    if not roaster:
+        log.info("Prefetch found no roster entry", extra={"tenant": tenant.id, "rosterEntryId": request.rosterEntryId})
+        return None
+
+    with scheduler.slot(tenant, interactive=True, ctx=ctx):
+        with stage(log, "report_download", tenant=tenant.id, rosterEntryId=roaster['rosterEntryId']):
+            pdf_path = report_cache_for(tenant).get_report(token, roaster, ctx)
+        with stage(log, "parse", tenant=tenant.id, rosterEntryId=roaster['rosterEntryId']):
+            return parse_report(pdf_path, roaster['displayBirthDate'], tenant, ctx)
+
+
+async def wait_for_prefetch(tenant, roaster, user, ctx):
+    """Waits for a running prefetch of the same report, whose results land in the caches.
+
+    A prefetch still queued behind the prefetch workers is cancelled
+    instead, the request is quicker doing the work itself.
+    """
+    for key in prefetch_keys(tenant, roaster, user):
+        future = prefetcher.get(key)
+        if future and not future.running():
+            future.cancel()
+        elif future:
+            # Waited on in short slices, so a cancelled request stops waiting promptly;
+            # concurrent.futures.wait never raises, a failed prefetch just falls through
+            while not future.done():
+                ctx.check("report download")
+                await asyncio.to_thread(concurrent.futures.wait, [future], min(1.0, ctx.remaining()))
+            return
+
+
+@app.post("/prefetch", status_code=202)
+async def prefetch(request: PrefetchRequest, tenant: Tenant = Depends(current_tenant)):
+    """Starts the report download and parse in the background for a practitioner."""
+    if request.rosterEntryId is not None:
+        key = prefetch_keys(tenant, roaster={'rosterEntryId': request.rosterEntryId})[0]
+    elif request.username and request.birth_date:
+        key = prefetch_keys(tenant, user=request)[0]
+    else:
+        raise HTTPException(
+            status_code=400, detail="Provide a rosterEntryId or a username and birth date.")
+
+    ctx = RequestContext(timeout=prefetcher.stale_after)
+    group = f"{tenant.id}:{request.clientId}" if request.clientId else None
+    queued = prefetcher.submit(key, prefetch_report, request, tenant, ctx, ctx=ctx, group=group)
+    return {"queued": queued}
+
+
 @app.get("/get-token")
-async def get_token():
-    pdcToken = await asyncio.to_thread(login_and_get_token)
-    crmToken = await asyncio.to_thread(get_crm_auth_token)
+async def get_token(tenant: Tenant = Depends(current_tenant)):
+    pdcToken = await asyncio.to_thread(get_pdc_token, tenant)
+    crmToken = await asyncio.to_thread(get_cached_crm_auth_token, tenant)
+    await asyncio.to_thread(ensure_user_index, crmToken, tenant)
     return {"pdcToken": pdcToken, "crmToken": crmToken}
 
 
+def ensure_user_index(crmToken, tenant):
+    """Starts a background sync of the CRM user index if no worker has a fresh one."""
+    if user_index_needs_sync(tenant):
+        index_syncs.submit(f"{tenant.id}:crm_index_sync", sync_user_index, crmToken, tenant)
+
+
 @app.post("/get-pdf-data")
-async def get_pdf_data(user: UserDetails):
+async def get_pdf_data(user: UserDetails, tenant: Tenant = Depends(current_tenant)):
     """Fetches the PDF data from FSMB API after login and extracts text."""
+    ctx = RequestContext()
+
     if user.pdcToken:
         token = user.pdcToken
     else:
-        token = await asyncio.to_thread(login_and_get_token)
+        token = await asyncio.to_thread(get_pdc_token, tenant, ctx)
 
-    roasters = await get_roasters(token)
+    roasters = await get_roster_snapshot(tenant, token, ctx)
 
     if not roasters:
         raise HTTPException(
             status_code=401, detail="Failed to retrieve roasters.")
 
     # Find the user in the roasters list
-    rosterEntryId = next(
-        (roster['rosterEntryId'] for roster in roasters
-         if f"{roster['lastName']}, {roster['firstName']} {roster['middleName']}".strip() == user.username and roster['displayBirthDate'] == user.birth_date),
-        None
-    )
+    roaster = find_roaster(roasters, user)
 
-    if not rosterEntryId:
+    if not roaster:
         raise HTTPException(
             status_code=404, detail="User not found in roasters.")
 
-    # FSMB API request
-    URL = 'https://pdc-appapi.fsmb.org/download/practitioner/report'
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json',
-    }
-    data = {
-        "rosterEntryIds": [rosterEntryId],
-        "customerId": 7881,
-    }
-
     try:
-        response = requests.post(URL, headers=headers, json=data)
-        response.raise_for_status()
-        
-        print(f"PDF Data Fetched... ${response.status_code}")
+        # Pick up a prefetch of this report if one is running
+        await wait_for_prefetch(tenant, roaster, user, ctx)
 
-        # Extract text from PDF bytes
-        pdf_text = extract_text_from_pdf_bytes(response.content)
+        # Download the report unless it is already cached
+        with stage(log, "report_download", tenant=tenant.id, rosterEntryId=roaster['rosterEntryId']):
+            pdf_path = await scheduler.run_async(
+                tenant, True, ctx, report_cache_for(tenant).get_report, token, roaster, ctx)
 
-        res = create_sheet(pdf_text, user.birth_date)
+        # Extract and parse the report, reusing any worker's earlier result
+        with stage(log, "parse", tenant=tenant.id, rosterEntryId=roaster['rosterEntryId']):
+            res = await scheduler.run_async(
+                tenant, True, ctx, parse_report, pdf_path, user.birth_date, tenant, ctx)
 
         return {'data': res,
                 "token": token if not user.pdcToken else None}
@@ -154,10 +402,18 @@ async def get_pdf_data(user: UserDetails):
             status_code=500, detail=f"Error processing PDF: {e}")
 
 
+def submit_key(tenant, user):
+    """Keys a submit by every input that changes what it writes, hashed to keep PII out of logs."""
+    fields = [tenant.id, user.username, user.birth_date, user.email.lower(), user.phone]
+    return "submit:" + hashlib.sha256("|".join(str(field) for field in fields).encode()).hexdigest()[:16]
+
+
 @app.post("/create-licence-entry")
-async def create_licence_entry(user: UserDetails):
+async def create_licence_entry(user: UserDetails, tenant: Tenant = Depends(current_tenant)):
     """Fetches the PDF data from FSMB API after login and extracts text."""
-    
+    # Deadline for the whole run, cancelled early if every client disconnects
+    ctx = RequestContext()
+
     async def progress_stream():
         try:
             # Initial validation
@@ -167,6 +423,11 @@ async def create_licence_entry(user: UserDetails):
             
             # Starting process
             yield f"data: {{'progress': 5, 'step': 'start', 'message': 'Starting license retrieval process...'}}\n\n"
+
+            # Check the CRM user index before any expensive stage
+            await asyncio.to_thread(ensure_user_index, user.crmToken, tenant)
+            if await asyncio.to_thread(lookup_user, email=user.email, tenant=tenant):
+                yield f"data: {{'progress': 5, 'step': 'start', 'message': 'Provider already exists in CRM, their profile will be updated...'}}\n\n"
             
             # Step 1a: Getting authentication token (10%)
             yield f"data: {{'progress': 10, 'step': 'authentication', 'message': 'Authenticating with FSMB...'}}\n\n"
@@ -174,12 +435,16 @@ async def create_licence_entry(user: UserDetails):
             if user.pdcToken:
                 token = user.pdcToken
             else:
-                token = await asyncio.to_thread(login_and_get_token)
+                with stage(log, "pdc_token", tenant=tenant.id):
+                    token = await asyncio.to_thread(get_pdc_token, tenant, ctx)
             
+            ctx.check("roster download")
+
             # Step 1b: Fetching roasters (20%)
             yield f"data: {{'progress': 20, 'step': 'fetch_roasters', 'message': 'Retrieving practitioner roster...'}}\n\n"
             
-            roasters = await get_roasters(token)
+            with stage(log, "roster", tenant=tenant.id):
+                roasters = await get_roster_snapshot(tenant, token, ctx)
 
             if not roasters:
                 raise HTTPException(
@@ -189,46 +454,32 @@ async def create_licence_entry(user: UserDetails):
             yield f"data: {{'progress': 25, 'step': 'find_user', 'message': 'Locating user information...'}}\n\n"
             
             # Find the user in the roasters list
-            rosterEntryId = next(
-                (roster['rosterEntryId'] for roster in roasters
-                if f"{roster['lastName']}, {roster['firstName']} {roster['middleName']}".strip() == user.username and roster['displayBirthDate'] == user.birth_date),
-                None
-            )
+            roaster = find_roaster(roasters, user)
 
-            if not rosterEntryId:
+            if not roaster:
                 raise HTTPException(
                     status_code=404, detail="User not found in roasters.")
-                
-            roaster = next((roster for roster in roasters if roster['rosterEntryId'] == rosterEntryId), None)
 
             # Step 1d: Requesting PDF report (35%)
             yield f"data: {{'progress': 35, 'step': 'request_report', 'message': 'Requesting license report from FSMB...'}}\n\n"
             
-            # FSMB API request
-            URL = 'https://pdc-appapi.fsmb.org/download/practitioner/report'
-            headers = {
-                'Authorization': f'Bearer {token}',
-                'Content-Type': 'application/json',
-            }
-            data = {
-                "rosterEntryIds": [rosterEntryId],
-                "customerId": 7881,
-            }
-
-            response = requests.post(URL, headers=headers, json=data)
-            response.raise_for_status()
+            # Pick up a prefetch of this report if one is running
+            await wait_for_prefetch(tenant, roaster, user, ctx)
+
+            # Download the report unless it is already cached
+            with stage(log, "report_download", tenant=tenant.id, rosterEntryId=roaster['rosterEntryId']):
+                pdf_path = await scheduler.run_async(
+                    tenant, True, ctx, report_cache_for(tenant).get_report, token, roaster, ctx)
             
             # Step 1e: Processing PDF data (45%)
             yield f"data: {{'progress': 45, 'step': 'process_pdf', 'message': 'Extracting license information from report...'}}\n\n"
-            
-            print(f"PDF Data Fetched... {response.status_code}")
 
-            # Extract text from PDF bytes
-            pdf_text = extract_text_from_pdf_bytes(response.content)
-            
-            yield f"data: {{'progress': 50, 'step': 'process_pdf', 'message': 'Processing license information...'}}\n\n"
-            
-            licenceData = create_sheet(pdf_text, user.birth_date)
+            # Extract and parse the report, reusing any worker's earlier result
+            with stage(log, "parse", tenant=tenant.id, rosterEntryId=roaster['rosterEntryId']):
+                licenceData = await scheduler.run_async(
+                    tenant, True, ctx, parse_report, pdf_path, user.birth_date, tenant, ctx)
+
+            ctx.check("CRM upload")
             
             # Step 2: Processing Provider Data (60%)
             yield f"data: {{'progress': 60, 'step': 'process_data', 'message': 'Preparing provider information for CRM...'}}\n\n"
@@ -243,13 +494,8 @@ async def create_licence_entry(user: UserDetails):
                 birthDate=licenceData["user_data"]["birthDate"],
             )
             
-            # Step 3: Adding Provider to CRM (75%)
-            yield f"data: {{'progress': 75, 'step': 'add_provider', 'message': 'Adding provider to CRM system...'}}\n\n"
-            
-            userId = add_provider(provider, authToken=user.crmToken)
-            
-            # Prepare license data (85%)
-            yield f"data: {{'progress': 85, 'step': 'prepare_licenses', 'message': 'Preparing license data for upload...'}}\n\n"
+            # Prepare license data (70%)
+            yield f"data: {{'progress': 70, 'step': 'prepare_licenses', 'message': 'Preparing license data for upload...'}}\n\n"
             
             licenses = [
                 Licenses(
@@ -261,21 +507,38 @@ async def create_licence_entry(user: UserDetails):
                 ) for licence in licenceData["licenses"]
             ]
             
-            # Step 4: Uploading Licenses (95%)
-            yield f"data: {{'progress': 95, 'step': 'upload_licenses', 'message': 'Uploading licenses to CRM...'}}\n\n"
-            
-            upload_licenses(userId, licenses, authToken=user.crmToken)
+            # CRM writes run to completion even if the client goes away
+            with ctx.critical():
+                # Step 3: Adding Provider and Licenses to CRM (80%)
+                yield f"data: {{'progress': 80, 'step': 'add_provider', 'message': 'Adding provider and uploading licenses to CRM...'}}\n\n"
+                
+                # Waits for a concurrent write for this email, and only skips if an identical one completed
+                with stage(log, "crm_write", tenant=tenant.id, licenses=len(licenses)):
+                    userId, action = await asyncio.to_thread(write_provider, provider, licenses, user.crmToken, tenant)
             
             # Process complete (100%)
-            yield f"data: {{'progress': 100, 'step': 'complete', 'message': 'Process completed successfully!', 'userId': '{userId}'}}\n\n"
+            if action == "updated":
+                yield f"data: {{'progress': 100, 'step': 'complete', 'message': 'Provider profile updated, their existing licenses were left unchanged.', 'userId': '{userId}'}}\n\n"
+            else:
+                yield f"data: {{'progress': 100, 'step': 'complete', 'message': 'Process completed successfully!', 'userId': '{userId}'}}\n\n"
+
+        except Cancelled as e:
+            log.info("Stopped abandoned request: %s", e)
 
         except Exception as e:
             # Format error message for SSE, escaping single quotes
             error_message = str(e).replace("'", "\\'")
             yield f"data: {{'progress': 0, 'step': 'error', 'message': 'Error: {error_message}'}}\n\n"
         
+    # Only identical submits share one run and its progress, a changed one
+    # starts its own and is serialised with it at the CRM write
+    if user.email:
+        stream = stream_coalescer.join(submit_key(tenant, user), progress_stream, on_abandon=ctx.cancel)
+    else:
+        stream = progress_stream()
+
     return StreamingResponse(
-        progress_stream(),
+        stream,
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -284,7 +547,100 @@ async def create_licence_entry(user: UserDetails):
     )
 
 
+def download_export_report(tenant, tokens, roster, ctx):
+    """Downloads a report for an export, logging in again if FSMB rejects the token.
+
+    Exports can outlast the FSMB token, so tokens holds the export's
+    current one and is shared by its worker threads. The rejected token was
+    already invalidated, so only one of them, in one worker, logs in again.
+    """
+    token = tokens["current"]
+    try:
+        return report_cache_for(tenant).get_report(token, roster, ctx)
+    except requests.exceptions.HTTPError as e:
+        if getattr(e.response, "status_code", None) != 401:
+            raise
+    if tokens["current"] == token:
+        tokens["current"] = get_pdc_token(tenant, ctx)
+    return report_cache_for(tenant).get_report(tokens["current"], roster, ctx)
+
+
+class ExportRequest(BaseModel):
+    rosterEntryIds: Optional[List[Union[int, str]]] = None
+    name: Optional[str] = None
+    format: Literal["xlsx", "csv"] = "xlsx"
+    pdcToken: Optional[str] = None
+
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+@app.post("/export")
+async def export(request: ExportRequest, http_request: Request, tenant: Tenant = Depends(current_tenant)):
+    """Streams the parsed licenses of the whole roster, or a filtered subset, as XLSX or CSV.
+
+    Exports run as batch work, so they only get upstream slots that no
+    interactive request is waiting for. Uncached providers cost a report
+    download and an LLM call each, around EXPORT_SECONDS_PER_PROVIDER
+    seconds, so the deadline grows with the export's size over the
+    tenant's export concurrency. CSV rows stream as they finish; an XLSX
+    only starts downloading once the last provider is done, so prefer CSV
+    for large rosters. A disconnect cancels the remaining work either way.
+    """
+    if request.pdcToken:
+        token = request.pdcToken
+    else:
+        token = await asyncio.to_thread(get_pdc_token, tenant)
+
+    roasters = await get_roster_snapshot(tenant, token)
+
+    ids = {str(rosterEntryId) for rosterEntryId in request.rosterEntryIds} if request.rosterEntryIds else None
+    name = request.name.lower() if request.name else None
+    entries = [
+        roster for roster in roasters
+        if (ids is None or str(roster.rosterEntryId) in ids)
+        and (name is None or name in (roster.name or "").lower())
+    ]
+
+    concurrency = tenant.exportConcurrency
+    estimate = len(entries) * float(os.getenv("EXPORT_SECONDS_PER_PROVIDER", 30)) / concurrency
+    ctx = RequestContext(timeout=max(float(os.getenv("EXPORT_TIMEOUT", 2 * 60 * 60)), estimate))
+    tokens = {"current": token}
+
+    def process(roster):
+        # One record per provider adds up over a whole roster, so keep a sample
+        with scheduler.slot(tenant, interactive=False, ctx=ctx), \
+                stage(log, "export_provider", sample_rate=0.1, tenant=tenant.id, rosterEntryId=roster.rosterEntryId):
+            pdf_path = download_export_report(tenant, tokens, roster, ctx)
+            return parse_report(pdf_path, roster.displayBirthDate, tenant, ctx)
+
+    rows = iter_export_rows(entries, process, concurrency, ctx)
+    body = iter_csv(rows) if request.format == "csv" else iter_xlsx(rows)
+
+    return StreamingResponse(
+        iter_until_disconnect(http_request, body, ctx),
+        media_type=EXPORT_MEDIA_TYPES[request.format],
+        headers={
+            "Content-Disposition": f'attachment; filename="licenses.{request.format}"',
+            "Cache-Control": "no-cache",
+        }
+    )
+
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
+# Startup-time budget check, the heavy stacks above must stay lazy
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", 2.0))
+if IMPORT_SECONDS > IMPORT_BUDGET_SECONDS:
+    log.warning("Importing main took %.2fs, over the %ss budget", IMPORT_SECONDS, IMPORT_BUDGET_SECONDS)
+
+
 if __name__ == "__main__":
+    import uvicorn
+
     ENV = os.getenv("ENV", "prod")
     uvicorn.run(
         "main:app",
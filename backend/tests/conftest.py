@@ -0,0 +1,14 @@
+import threading
+
+import pytest
+
+from utils.shared_cache import shared_cache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """Points the process-wide shared cache at a fresh database."""
+    monkeypatch.setattr(shared_cache, "path", str(tmp_path / "shared_cache.db"))
+    monkeypatch.setattr(shared_cache, "_local", threading.local())
+    monkeypatch.setattr(shared_cache, "_memo", {})
+    return shared_cache
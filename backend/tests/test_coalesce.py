@@ -0,0 +1,81 @@
+import asyncio
+
+from utils.coalesce import StreamCoalescer
+
+
+class Source:
+    """An async generator factory that counts its runs and emits events as they are released."""
+
+    def __init__(self, events):
+        self.events = events
+        self.runs = 0
+        self.release = None
+
+    def __call__(self):
+        self.runs += 1
+        return self.stream()
+
+    async def stream(self):
+        for event in self.events:
+            await self.release.get()
+            yield event
+
+
+async def drain(stream, out):
+    async for event in stream:
+        out.append(event)
+
+
+def test_duplicates_share_one_run_and_late_subscribers_get_a_replay():
+    async def run():
+        source = Source(["a", "b", "c"])
+        source.release = asyncio.Queue()
+        coalescer = StreamCoalescer()
+
+        first, late = [], []
+        first_task = asyncio.create_task(drain(coalescer.join("submit:1", source), first))
+        source.release.put_nowait(None)
+        while not first:
+            await asyncio.sleep(0)
+
+        late_task = asyncio.create_task(drain(coalescer.join("submit:1", source), late))
+        for _ in range(2):
+            source.release.put_nowait(None)
+        await asyncio.gather(first_task, late_task)
+
+        assert source.runs == 1
+        assert first == late == ["a", "b", "c"]
+
+        # A finished run is forgotten, the next submit starts its own
+        for _ in range(3):
+            source.release.put_nowait(None)
+        await drain(coalescer.join("submit:1", source), [])
+        assert source.runs == 2
+
+    asyncio.run(run())
+
+
+def test_abandon_fires_once_the_last_subscriber_leaves():
+    async def run():
+        source = Source(["a", "b"])
+        source.release = asyncio.Queue()
+        coalescer = StreamCoalescer()
+        abandoned = []
+
+        streams = [coalescer.join("submit:1", source, on_abandon=lambda: abandoned.append(True)) for _ in range(2)]
+        source.release.put_nowait(None)
+        assert [await anext(stream) for stream in streams] == ["a", "a"]
+
+        await streams[0].aclose()
+        assert abandoned == []
+        await streams[1].aclose()
+        assert abandoned == [True]
+
+        # An abandoned run is not joined again, a new submit starts fresh;
+        # the old run is still waiting for its next event, so release one each
+        for _ in range(2):
+            source.release.put_nowait(None)
+        assert await anext(coalescer.join("submit:1", source)) == "a"
+        assert source.runs == 2
+
+    asyncio.run(run())
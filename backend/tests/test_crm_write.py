@@ -0,0 +1,79 @@
+import pytest
+
+import crm
+from crm import Licenses, Provider, lookup_user, write_provider
+from utils.tenants import Tenant
+
+
+TENANT = Tenant(id="acme", customerId=1)
+PROVIDER = Provider(firstName="Ana", lastName="Lee", email="Ana@example.com", phoneNumber="5551234567",
+                    profession="MD", npi="1234567890")
+LICENSES = [Licenses(state="CA", licenseNumber="A1", licenseType="Medical License",
+                     issueDate="01/01/2020", expirationDate="01/01/2030")]
+
+
+class FakeCrm:
+    """Records the CRM calls write_provider makes, failing the ones listed in fail."""
+
+    def __init__(self, monkeypatch):
+        self.calls = []
+        self.fail = set()
+        self.users = 0
+        monkeypatch.setattr(crm, "add_provider", self.add_provider)
+        monkeypatch.setattr(crm, "update_user_profile", self.call("update"))
+        monkeypatch.setattr(crm, "upload_licenses", self.call("upload"))
+
+    def call(self, name):
+        def run(userId, *args):
+            self.calls.append((name, userId))
+            if name in self.fail:
+                raise Exception(f"{name} failed")
+        return run
+
+    def add_provider(self, provider, authToken, tenant=None):
+        self.users += 1
+        userId = f"user-{self.users}"
+        self.calls.append(("add", userId))
+        return userId
+
+
+@pytest.fixture
+def fake_crm(cache, monkeypatch):
+    return FakeCrm(monkeypatch)
+
+
+def test_new_provider_is_created_with_licenses(fake_crm):
+    assert write_provider(PROVIDER, LICENSES, "token", TENANT) == ("user-1", "created")
+    assert fake_crm.calls == [("add", "user-1"), ("update", "user-1"), ("upload", "user-1")]
+    assert lookup_user(email="ana@example.com", tenant=TENANT) == "user-1"
+
+
+def test_identical_resubmit_is_a_duplicate(fake_crm):
+    write_provider(PROVIDER, LICENSES, "token", TENANT)
+    assert write_provider(PROVIDER, LICENSES, "token", TENANT) == ("user-1", "duplicate")
+    assert len(fake_crm.calls) == 3
+
+
+def test_existing_provider_only_gets_a_profile_update(fake_crm):
+    write_provider(PROVIDER, LICENSES, "token", TENANT)
+    changed = PROVIDER.model_copy(update={"phoneNumber": "5559876543"})
+    assert write_provider(changed, LICENSES, "token", TENANT) == ("user-1", "updated")
+    assert fake_crm.calls[3:] == [("update", "user-1")]
+
+
+@pytest.mark.parametrize("failing", ["update", "upload"])
+def test_retry_after_a_failure_resumes_the_created_provider(fake_crm, failing):
+    fake_crm.fail = {failing}
+    with pytest.raises(Exception, match=f"{failing} failed"):
+        write_provider(PROVIDER, LICENSES, "token", TENANT)
+
+    # AddUser succeeded, the retry must finish that user rather than add another
+    # or treat it as an existing one, whose licenses are never uploaded
+    fake_crm.fail = set()
+    assert write_provider(PROVIDER, LICENSES, "token", TENANT) == ("user-1", "created")
+    assert fake_crm.users == 1
+    assert fake_crm.calls[-2:] == [("update", "user-1"), ("upload", "user-1")]
+
+    # Once uploaded, the next change is a plain update again
+    changed = PROVIDER.model_copy(update={"phoneNumber": "5559876543"})
+    assert write_provider(changed, LICENSES, "token", TENANT) == ("user-1", "updated")
@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from utils.deadline import Cancelled, DeadlineExceeded, RequestContext
+
+
+def test_single_flight_waiter_gives_up_with_its_request(cache):
+    started, release = threading.Event(), threading.Event()
+
+    def slow_login():
+        started.set()
+        release.wait(5)
+        return "token"
+
+    holder = threading.Thread(target=cache.single_flight, args=("pdc_token:acme", slow_login, 60))
+    holder.start()
+    started.wait(5)
+
+    ctx = RequestContext(timeout=60)
+    threading.Timer(0.2, ctx.cancel).start()
+    began = time.monotonic()
+    with pytest.raises(Cancelled):
+        cache.single_flight("pdc_token:acme", lambda: "other", 60, poll_interval=0.05, ctx=ctx)
+    assert time.monotonic() - began < 2
+
+    release.set()
+    holder.join(5)
+    assert cache.get("pdc_token:acme") == "token"
+
+
+@pytest.mark.parametrize("cancel", [True, False])
+def test_wait_for_prefetch_stops_with_its_request(monkeypatch, cancel):
+    import main
+    from utils.tenants import Tenant
+
+    future = Future()
+    future.set_running_or_notify_cancel()
+    monkeypatch.setattr(main.prefetcher, "get", lambda key: future)
+
+    async def wait():
+        ctx = RequestContext(timeout=60 if cancel else 0.3)
+        if cancel:
+            asyncio.get_running_loop().call_later(0.2, ctx.cancel)
+        await main.wait_for_prefetch(Tenant(id="acme", customerId=1), {"rosterEntryId": 1}, None, ctx)
+
+    began = time.monotonic()
+    with pytest.raises(Cancelled if cancel else DeadlineExceeded):
+        asyncio.run(wait())
+    assert time.monotonic() - began < 2
+
+
+def test_queued_prefetch_is_cancelled_instead_of_waited_for(monkeypatch):
+    import main
+    from utils.tenants import Tenant
+
+    future = Future()
+    monkeypatch.setattr(main.prefetcher, "get", lambda key: future)
+
+    began = time.monotonic()
+    asyncio.run(main.wait_for_prefetch(
+        Tenant(id="acme", customerId=1), {"rosterEntryId": 1}, None, RequestContext(timeout=60)))
+    assert time.monotonic() - began < 1
+    assert future.cancelled()
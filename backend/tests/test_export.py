@@ -0,0 +1,63 @@
+import pytest
+import requests
+
+import main
+from utils import pdc
+from utils.deadline import RequestContext
+from utils.tenants import Tenant
+
+
+TENANT = Tenant(id="acme", customerId=1)
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code}", response=self)
+
+    def iter_content(self, chunk_size):
+        yield b"%PDF"
+
+
+def test_rejected_report_token_is_invalidated(cache, monkeypatch):
+    cache.set("pdc_token:acme", "expired", ttl=60)
+    monkeypatch.setattr(pdc.requests, "post", lambda *args, **kwargs: FakeResponse(401))
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        list(pdc.iter_report_chunks("expired", 1, tenant=TENANT))
+    assert cache.get("pdc_token:acme") is None
+
+
+def test_export_logs_in_again_once_the_token_expires(monkeypatch):
+    downloads = []
+    logins = []
+
+    class FakeReportCache:
+        def get_report(self, token, roster, ctx):
+            downloads.append(token)
+            if token == "expired":
+                FakeResponse(401).raise_for_status()
+            return f"{roster['rosterEntryId']}.pdf"
+
+    def login(tenant, ctx=None):
+        logins.append(tenant.id)
+        return "fresh"
+
+    monkeypatch.setattr(main, "report_cache_for", lambda tenant: FakeReportCache())
+    monkeypatch.setattr(main, "get_pdc_token", login)
+
+    tokens = {"current": "expired"}
+    ctx = RequestContext(timeout=60)
+    assert main.download_export_report(TENANT, tokens, {"rosterEntryId": 1}, ctx) == "1.pdf"
+    assert main.download_export_report(TENANT, tokens, {"rosterEntryId": 2}, ctx) == "2.pdf"
+    assert downloads == ["expired", "fresh", "fresh"]
+    assert logins == ["acme"]
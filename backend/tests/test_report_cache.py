@@ -0,0 +1,59 @@
+import os
+import time
+
+from utils.report_cache import ReportCache
+from utils.tenants import Tenant
+
+
+TENANT = Tenant(id="acme", customerId=1)
+
+
+def make_cache(tmp_path, max_bytes=1024):
+    cache = ReportCache(TENANT, directory=str(tmp_path / "reports"), max_bytes=max_bytes)
+    cache.grace = 60
+    os.makedirs(cache.blob_dir, exist_ok=True)
+    return cache
+
+
+def age(path, seconds):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_hit_returns_the_stored_blob_without_rewriting_the_index(tmp_path):
+    cache = make_cache(tmp_path)
+    roster = {"rosterEntryId": 1, "lastUpdatedDate": "2024-01-01"}
+    path = cache.store(roster, [b"%PDF", b"-1"])
+    index_mtime = os.stat(cache.index_path).st_mtime_ns
+
+    assert cache.lookup(roster) == path
+    assert open(path, "rb").read() == b"%PDF-1"
+    assert os.stat(cache.index_path).st_mtime_ns == index_mtime
+
+    # A new marker means FSMB changed the report
+    assert cache.lookup({"rosterEntryId": 1, "lastUpdatedDate": "2024-02-01"}) is None
+
+
+def test_eviction_spares_blobs_used_within_the_grace_period(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=10)
+    old = cache.store({"rosterEntryId": 1, "lastUpdatedDate": "a"}, [b"x" * 8])
+    recent = cache.store({"rosterEntryId": 2, "lastUpdatedDate": "a"}, [b"y" * 8])
+    age(old, 120)
+
+    cache.store({"rosterEntryId": 3, "lastUpdatedDate": "a"}, [b"z" * 8])
+    assert not os.path.exists(old)
+    assert os.path.exists(recent)
+
+
+def test_abandoned_partial_downloads_are_swept(tmp_path):
+    cache = make_cache(tmp_path)
+    abandoned = os.path.join(cache.blob_dir, "crashed.part")
+    in_progress = os.path.join(cache.blob_dir, "downloading.part")
+    for path in (abandoned, in_progress):
+        with open(path, "wb") as file:
+            file.write(b"%PDF")
+    age(abandoned, 120)
+
+    cache.store({"rosterEntryId": 1, "lastUpdatedDate": "a"}, [b"%PDF"])
+    assert not os.path.exists(abandoned)
+    assert os.path.exists(in_progress)
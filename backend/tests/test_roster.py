@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+from utils.roster import iter_json_array, parse_roster
+
+
+def entry(rosterEntryId, firstName, lastName, middleName, displayBirthDate, **extra):
+    return {"rosterEntryId": rosterEntryId, "firstName": firstName, "lastName": lastName,
+            "middleName": middleName, "suffix": None, "displayBirthDate": displayBirthDate, **extra}
+
+
+ITEMS = [
+    entry(1, "Ana", "Lee", "M", "01/02/1980"),
+    entry(2, "Zoë [\"x\"]", "O'Neil}", None, "03/04/1975", nested={"list": [1, {"items": []}]}),
+    entry(3, "Wei", "Chen", "", "05/06/1990", lastUpdatedDate="2024-01-01"),
+]
+BODY = json.dumps({"totalCount": 3, "items": ITEMS, "pageIndex": 0}, ensure_ascii=False).encode()
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, len(BODY)])
+def test_items_survive_any_chunk_boundary(size):
+    assert list(iter_json_array(chunked(BODY, size), "items")) == ITEMS
+
+
+def test_every_split_point():
+    for split in range(1, len(BODY)):
+        assert list(iter_json_array([BODY[:split], BODY[split:]], "items")) == ITEMS
+
+
+def test_empty_array():
+    assert list(iter_json_array([b'{"items": [ ]}'], "items")) == []
+
+
+def test_truncated_body_raises():
+    with pytest.raises(ValueError):
+        list(iter_json_array([BODY[:len(BODY) // 2]], "items"))
+
+
+def test_parse_roster_builds_lookup():
+    roster = parse_roster(chunked(BODY, 5))
+    assert [entry.rosterEntryId for entry in roster] == [1, 2, 3]
+    assert roster.get(3).marker == "2024-01-01"
+    assert roster.find("Lee, Ana M", "01/02/1980").rosterEntryId == 1
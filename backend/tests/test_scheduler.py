@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from utils.deadline import Cancelled, DeadlineExceeded, RequestContext
+from utils.scheduler import FairScheduler
+from utils.tenants import Tenant
+
+
+ACME = Tenant(id="acme", customerId=1, maxConcurrency=2)
+BETA = Tenant(id="beta", customerId=2, maxConcurrency=2)
+
+
+def hold_slot(scheduler, tenant, release, interactive=True):
+    thread = threading.Thread(target=scheduler.run, args=(tenant, interactive, None, release.wait))
+    thread.start()
+    return thread
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def start_waiters(scheduler, jobs, order):
+    """Starts one thread per (tenant, interactive, name) job, each queued before the next starts."""
+    threads = []
+    for tenant, interactive, name in jobs:
+        queued = scheduler.metrics().get(tenant.id, {}).get("waiting", 0)
+        thread = threading.Thread(target=scheduler.run, args=(tenant, interactive, None, order.append, name))
+        thread.start()
+        wait_until(lambda: scheduler.metrics()[tenant.id]["waiting"] == queued + 1)
+        threads.append(thread)
+    return threads
+
+
+def test_interactive_jobs_go_before_batch_and_tenants_take_turns():
+    scheduler = FairScheduler(max_slots=1)
+    release = threading.Event()
+    holder = hold_slot(scheduler, ACME, release)
+    wait_until(lambda: scheduler.metrics()["acme"]["running"] == 1)
+
+    order = []
+    threads = start_waiters(scheduler, [
+        (ACME, False, "acme-batch-1"),
+        (ACME, False, "acme-batch-2"),
+        (ACME, True, "acme-1"),
+        (ACME, True, "acme-2"),
+        (BETA, True, "beta-1"),
+    ], order)
+
+    release.set()
+    for thread in [holder, *threads]:
+        thread.join(5)
+
+    # acme just ran, so beta's interactive job goes first, then turns alternate
+    assert order == ["beta-1", "acme-1", "acme-2", "acme-batch-1", "acme-batch-2"]
+
+
+def test_per_tenant_limit_leaves_slots_for_other_tenants():
+    scheduler = FairScheduler(max_slots=4)
+    release = threading.Event()
+    holders = [hold_slot(scheduler, ACME, release) for _ in range(2)]
+    wait_until(lambda: scheduler.metrics()["acme"]["running"] == 2)
+
+    # acme is at its limit of 2, so a third acme job waits while beta runs
+    blocked = threading.Thread(target=scheduler.run, args=(ACME, True, None, lambda: None))
+    blocked.start()
+    wait_until(lambda: scheduler.metrics()["acme"]["waiting"] == 1)
+    assert scheduler.run(BETA, True, None, lambda: "ran") == "ran"
+    assert scheduler.metrics()["acme"]["waiting"] == 1
+
+    release.set()
+    for thread in [*holders, blocked]:
+        thread.join(5)
+    assert scheduler.metrics()["acme"]["completed"] == 3
+
+
+@pytest.mark.parametrize("cancel", [True, False])
+def test_waiters_give_up_with_their_request(cancel):
+    scheduler = FairScheduler(max_slots=1)
+    release = threading.Event()
+    holder = hold_slot(scheduler, ACME, release)
+    wait_until(lambda: scheduler.metrics()["acme"]["running"] == 1)
+
+    ctx = RequestContext(timeout=60 if cancel else 0.2)
+    if cancel:
+        threading.Timer(0.1, ctx.cancel).start()
+    with pytest.raises(Cancelled if cancel else DeadlineExceeded):
+        scheduler.run(BETA, True, ctx, lambda: None)
+
+    metrics = scheduler.metrics()["beta"]
+    assert metrics["abandoned"] == 1 and metrics["waiting"] == 0
+
+    release.set()
+    holder.join(5)
+    assert scheduler.run(BETA, True, None, lambda: "ran") == "ran"
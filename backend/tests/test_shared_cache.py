@@ -0,0 +1,98 @@
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from utils.shared_cache import SharedCache
+
+
+def swap_token(path, owner):
+    """Runs in another process, trying to replace the shared token with its own."""
+    return SharedCache(path).compare_and_set("pdc_token:acme", "old", owner, ttl=60)
+
+
+def login_once(path, calls_path):
+    """Runs in another process, logging in through single_flight and recording each real login."""
+    def compute():
+        with open(calls_path, "a") as calls:
+            calls.write("login\n")
+        time.sleep(0.3)
+        return "token"
+    return SharedCache(path).single_flight("pdc_token:acme", compute, ttl=60, poll_interval=0.05)
+
+
+def test_compare_and_set_has_one_winner_across_processes(cache):
+    cache.set("pdc_token:acme", "old", ttl=60)
+    with ProcessPoolExecutor(4) as pool:
+        results = list(pool.map(swap_token, [cache.path] * 8, [f"worker-{n}" for n in range(8)]))
+
+    assert results.count(True) == 1
+    assert cache.get("pdc_token:acme") == f"worker-{results.index(True)}"
+
+
+def test_compare_and_set_leaves_a_refreshed_value_alone(cache):
+    cache.set("pdc_token:acme", "refreshed", ttl=60)
+    assert not cache.compare_and_set("pdc_token:acme", "rejected", None)
+    assert cache.get("pdc_token:acme") == "refreshed"
+
+    assert cache.compare_and_set("pdc_token:acme", "refreshed", None)
+    assert cache.get("pdc_token:acme") is None
+
+
+def test_single_flight_computes_once_across_processes(cache, tmp_path):
+    calls = tmp_path / "calls"
+    with ProcessPoolExecutor(4) as pool:
+        results = list(pool.map(login_once, [cache.path] * 4, [str(calls)] * 4))
+
+    assert results == ["token"] * 4
+    assert calls.read_text().splitlines() == ["login"]
+
+
+def test_single_flight_takes_over_an_expired_lease(cache):
+    # A worker that died mid-login leaves its lease behind until it expires
+    assert cache._acquire("pdc_token:acme", "dead-worker", 0.3)
+
+    began = time.monotonic()
+    assert cache.single_flight("pdc_token:acme", lambda: "token", ttl=60, poll_interval=0.05) == "token"
+    assert 0.3 <= time.monotonic() - began < 2
+
+
+def test_single_flight_does_not_cache_failures(cache):
+    assert cache.single_flight("pdc_token:acme", lambda: None, ttl=60) is None
+    assert cache.single_flight("pdc_token:acme", lambda: "token", ttl=60) == "token"
+
+
+def test_lease_serialises_holders_and_times_out(cache):
+    order = []
+
+    def hold(name):
+        with cache.lease("crm:acme:ana@example.com", poll_interval=0.01):
+            order.append(f"{name} in")
+            time.sleep(0.1)
+            order.append(f"{name} out")
+
+    threads = [threading.Thread(target=hold, args=(name,)) for name in "ab"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert order in (["a in", "a out", "b in", "b out"], ["b in", "b out", "a in", "a out"])
+
+    assert cache._acquire("crm:acme:ana@example.com", "other-worker", 60)
+    with pytest.raises(TimeoutError):
+        with cache.lease("crm:acme:ana@example.com", timeout=0.2, poll_interval=0.05):
+            pass
+
+
+def test_memo_sees_another_workers_write(cache):
+    other = SharedCache(cache.path)
+    cache.set("roster:acme", [1], ttl=60)
+    assert cache.get("roster:acme", memo=True) == [1]
+
+    other.set("roster:acme", [1, 2], ttl=60)
+    assert cache.get("roster:acme", memo=True) == [1, 2]
+
+    other.delete("roster:acme")
+    assert cache.get("roster:acme", memo=True) is None
+    assert "roster:acme" not in cache._memo
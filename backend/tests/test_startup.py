@@ -0,0 +1,43 @@
+import json
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAZY_MODULES = ("selenium", "langchain", "langchain_community", "openai")
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", 2.0))
+
+
+@pytest.fixture(scope="module")
+def import_main(tmp_path_factory):
+    """Imports main in a fresh interpreter and returns the loaded heavy modules and -X importtime output."""
+    tmp = tmp_path_factory.mktemp("startup")
+    env = dict(os.environ, SHARED_CACHE_PATH=str(tmp / "shared_cache.db"), REPORT_CACHE_DIR=str(tmp / "reports"))
+    script = (
+        "import sys, json, main; "
+        f"print(json.dumps([name for name in sys.modules if name.split('.')[0] in {LAZY_MODULES!r}]))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        cwd=BACKEND, env=env, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr[-2000:]
+    loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return loaded, result.stderr
+
+
+def test_heavy_dependencies_stay_lazy(import_main):
+    loaded, _ = import_main
+    assert loaded == []
+
+
+def test_import_within_budget(import_main):
+    _, importtime = import_main
+    # Lines look like "import time:  self [us] | cumulative | imported package"
+    match = re.search(r"^import time:\s+\d+ \|\s+(\d+) \| main$", importtime, re.M)
+    assert match, "main missing from -X importtime output"
+    seconds = int(match.group(1)) / 1e6
+    assert seconds <= IMPORT_BUDGET_SECONDS, f"importing main took {seconds:.2f}s"
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+from utils.log import log_key
+
+
+log = logging.getLogger(__name__)
+
+
+class Broadcast:
+    """Runs one async generator in its own task and fans its events out to every subscriber.
+
+    Late subscribers first get the events they missed, so a duplicate request
+    sees the same progress stream as the one that started the work. Once the
+    last subscriber disconnects before the source finishes, on_abandon is
+    called so the work can be cancelled.
+    """
+
+    def __init__(self, source, on_abandon=None):
+        self.events = []
+        self.done = False
+        self.subscribers = 0
+        self.abandoned = False
+        self._on_abandon = on_abandon
+        self._changed = asyncio.Condition()
+        self.task = asyncio.create_task(self._run(source))
+
+    async def _run(self, source):
+        try:
+            async for event in source:
+                async with self._changed:
+                    self.events.append(event)
+                    self._changed.notify_all()
+        finally:
+            async with self._changed:
+                self.done = True
+                self._changed.notify_all()
+
+    async def subscribe(self):
+        seen = 0
+        self.subscribers += 1
+        try:
+            while True:
+                async with self._changed:
+                    await self._changed.wait_for(lambda: len(self.events) > seen or self.done)
+                    events = self.events[seen:]
+                    done = self.done
+                for event in events:
+                    yield event
+                seen += len(events)
+                if done and seen >= len(self.events):
+                    return
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and not self.done and self._on_abandon:
+                log.info("All clients disconnected, cancelling in-flight request")
+                self.abandoned = True
+                self._on_abandon()
+
+
+class StreamCoalescer:
+    """Shares one in-flight async generator between concurrent requests with the same key."""
+
+    def __init__(self):
+        self._flights = {}
+
+    def join(self, key, factory, on_abandon=None):
+        """Subscribes to the in-flight stream for key, starting factory() if there is none."""
+        flight = self._flights.get(key)
+        if flight is None or flight.done or flight.abandoned:
+            flight = Broadcast(factory(), on_abandon)
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            log.info("Joining in-flight request", extra={"key": log_key(key)})
+        return flight.subscribe()
+
+    def _forget(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+
+stream_coalescer = StreamCoalescer()
@@ -0,0 +1,61 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Cancelled(Exception):
+    """Raised when nobody is waiting for the request's result anymore."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a request runs past its deadline."""
+
+
+class RequestContext:
+    """Deadline and cancellation flag for one request.
+
+    The pipeline calls check() between stages and passes timeout() to every
+    upstream call. Both are thread-safe, so work running in asyncio.to_thread
+    sees a cancel() from the event loop. Inside critical() checks are
+    suspended, for CRM writes that must run to completion once started.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout_seconds = timeout or float(os.getenv("REQUEST_TIMEOUT", 5 * 60))
+        self.expires_at = time.monotonic() + self.timeout_seconds
+        self._cancelled = threading.Event()
+        self._critical = 0
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def check(self, stage="next stage"):
+        if self._critical:
+            return
+        if self.cancelled:
+            raise Cancelled(f"Request cancelled before {stage}")
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(
+                f"Request exceeded its {self.timeout_seconds:.0f}s deadline before {stage}")
+
+    def timeout(self, cap=None, stage="upstream call"):
+        """Returns the time left for an upstream call, raising if none is left."""
+        self.check(stage)
+        remaining = self.remaining()
+        return min(remaining, cap) if cap else remaining
+
+    @contextmanager
+    def critical(self):
+        self._critical += 1
+        try:
+            yield
+        finally:
+            self._critical -= 1
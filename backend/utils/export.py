@@ -0,0 +1,151 @@
+import asyncio
+import contextvars
+import csv
+import io
+import itertools
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+log = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = [
+    "rosterEntryId",
+    "name",
+    "npi",
+    "profession",
+    "state",
+    "state_code",
+    "license_number",
+    "issue_date",
+    "expiration_date",
+    "error",
+]
+
+
+def license_rows(roster, result):
+    """Flattens one provider's parsed sheet into one row per license."""
+    if isinstance(result, Exception):
+        return [[roster.rosterEntryId, roster.name, None, None, None, None, None, None, None, str(result)]]
+
+    user_data = result["user_data"]
+    base = [roster.rosterEntryId, roster.name, user_data["npi"], user_data["profession"]]
+    if not result["licenses"]:
+        return [base + [None, None, None, None, None, None]]
+    return [
+        base + [
+            licence["state"],
+            licence["state_code"],
+            licence["license_number"],
+            licence["issue_date"],
+            licence["expiration_date"],
+            None,
+        ] for licence in result["licenses"]
+    ]
+
+
+def iter_results(entries, process, concurrency, ctx=None):
+    """Runs process(entry) with at most `concurrency` in flight, yielding (entry, result) as they finish.
+
+    Failures are yielded as the exception instead of aborting the export.
+    Only a small window of entries is queued at a time, and closing the
+    generator or cancelling ctx stops queueing the rest.
+    """
+    entries = iter(entries)
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="export")
+    pending = {}
+
+    def fill():
+        while len(pending) < concurrency * 2 and not (ctx and ctx.cancelled):
+            entry = next(entries, None)
+            if entry is None:
+                return
+            # Carry the request id into the worker threads' log records
+            pending[executor.submit(contextvars.copy_context().run, process, entry)] = entry
+
+    try:
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                entry = pending.pop(future)
+                try:
+                    yield entry, future.result()
+                except Exception as e:
+                    log.warning("Export of a provider failed: %s", e, extra={"rosterEntryId": entry.rosterEntryId})
+                    yield entry, e
+            fill()
+    finally:
+        if ctx:
+            ctx.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_export_rows(entries, process, concurrency, ctx=None):
+    for entry, result in iter_results(entries, process, concurrency, ctx):
+        yield from license_rows(entry, result)
+
+
+async def iter_until_disconnect(request, body, ctx, poll_interval=1.0):
+    """Streams a sync body from a worker thread, cancelling ctx once the client goes away.
+
+    Starlette only notices a disconnect when it next sends, and an XLSX body
+    sends nothing until every provider is parsed, so the request is polled
+    here instead. Cancelling ctx makes iter_results stop queueing providers
+    and the in-flight ones stop at their next check.
+    """
+    async def watch():
+        while not await request.is_disconnected():
+            await asyncio.sleep(poll_interval)
+        ctx.cancel()
+
+    watcher = asyncio.create_task(watch())
+    body = iter(body)
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, body, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        watcher.cancel()
+        ctx.cancel()
+
+
+def iter_csv(rows):
+    """Streams rows as CSV, one encoded line at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in itertools.chain([EXPORT_COLUMNS], rows):
+        writer.writerow(row)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def iter_xlsx(rows, chunk_size=64 * 1024):
+    """Builds an XLSX with openpyxl's write-only mode and streams the finished file.
+
+    Write-only worksheets spill rows to disk as they are appended, so memory
+    stays flat. The xlsx zip can only be assembled once every row is in, so
+    bytes start flowing after the last provider has been parsed.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Licenses")
+    sheet.append(EXPORT_COLUMNS)
+    for row in rows:
+        sheet.append(row)
+
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        workbook.save(path)
+        with open(path, "rb") as file:
+            while chunk := file.read(chunk_size):
+                yield chunk
+    finally:
+        os.remove(path)
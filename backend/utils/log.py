@@ -0,0 +1,230 @@
+import atexit
+import contextvars
+import copy
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+job_id_var = contextvars.ContextVar("job_id", default=None)
+
+# Field names whose values are never written out
+SECRET_KEYS = re.compile(r"token|secret|password|passwd|otp|authorization|api_?key|cookie", re.I)
+# Secrets that can turn up inside messages, e.g. in an upstream error text
+SECRET_PATTERNS = [
+    re.compile(r"eyJ[\w-]+\.[\w-]+\.[\w-]*"),
+    re.compile(r"(?i)(bearer\s+)[\w\-.~+/]+=*"),
+]
+REDACTED = "[redacted]"
+
+# Attributes every LogRecord has, anything else was passed in extra=
+RECORD_ATTRS = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "taskName", "sample_rate"}
+
+
+def redact(value):
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if SECRET_KEYS.search(str(key)) else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    if isinstance(value, str):
+        for pattern in SECRET_PATTERNS:
+            value = pattern.sub(lambda match: (match.group(1) if match.groups() else "") + REDACTED, value)
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, with secrets redacted."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "job_id": getattr(record, "job_id", None),
+        }
+        entry.update({
+            key: value for key, value in record.__dict__.items()
+            if key not in RECORD_ATTRS and key not in entry
+        })
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(redact(entry), default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of records per level, warnings and errors are always kept.
+
+    Rates come from LOG_SAMPLE_RATES, e.g. "DEBUG=0.01,INFO=1". A record can
+    set its own rate with extra={"sample_rate": 0.1} for high-volume events.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = rates if rates is not None else self.parse_rates(os.getenv("LOG_SAMPLE_RATES", "DEBUG=0.1"))
+
+    @staticmethod
+    def parse_rates(spec):
+        rates = {}
+        for item in filter(None, spec.split(",")):
+            level, _, rate = item.partition("=")
+            rates[logging.getLevelName(level.strip().upper())] = float(rate)
+        return rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = getattr(record, "sample_rate", None)
+        if rate is None:
+            rate = self.rates.get(record.levelno, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the background writer without ever blocking the caller.
+
+    Records are tagged with the current request and job ids here, since the
+    writer thread doesn't see the caller's context. When the queue is full
+    records are dropped and counted rather than waited on.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        record.request_id = request_id_var.get()
+        record.job_id = job_id_var.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler = None
+_listener = None
+
+
+def configure_logging():
+    """Routes all logging through a bounded queue to a background JSON writer on stdout."""
+    global _handler, _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", 10000)))
+    writer = logging.StreamHandler(sys.stdout)
+    writer.setFormatter(JsonFormatter())
+
+    _handler = QueueHandler(log_queue)
+    _handler.addFilter(SamplingFilter())
+    _listener = logging.handlers.QueueListener(log_queue, writer)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    root.handlers = [_handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+
+def log_stats():
+    if _handler is None:
+        return {"queued": 0, "dropped": 0}
+    return {"queued": _handler.queue.qsize(), "dropped": _handler.dropped}
+
+
+def log_key(key):
+    """Stands in for a key in log records, since keys can hold names, birth dates and emails."""
+    return hashlib.sha256(str(key).encode()).hexdigest()[:12]
+
+
+@contextmanager
+def job(job_id):
+    """Tags records logged inside the block with a background job id."""
+    token = job_id_var.set(job_id)
+    try:
+        yield
+    finally:
+        job_id_var.reset(token)
+
+
+@contextmanager
+def stage(logger, name, sample_rate=None, **fields):
+    """Logs how long the block took under the given stage name, and whether it failed."""
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException as e:
+        outcome = type(e).__name__
+        raise
+    finally:
+        extra = {"stage": name, "duration_ms": round((time.perf_counter() - started) * 1000, 1), "outcome": outcome, **fields}
+        if sample_rate is not None:
+            extra["sample_rate"] = sample_rate
+        logger.info("Stage %s finished", name, extra=extra)
+
+
+class RequestIds:
+    """ASGI middleware giving every request an id for its log records.
+
+    The id is taken from an incoming X-Request-ID header or generated, and
+    echoed back in the response. One access record per request is logged
+    once the response, streamed or not, has been fully sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = logging.getLogger("access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            self.logger.info("%s %s %s", scope["method"], scope["path"], status, extra={
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            })
+            request_id_var.reset(token)
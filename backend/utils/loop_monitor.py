@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+
+log = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    """Detects event-loop stalls and records what was blocking the loop.
+
+    A heartbeat task on the loop stamps the time every interval. A watchdog
+    thread notices when the stamp goes stale and captures the loop thread's
+    stack and current task right then, while the blocking call is still on
+    the stack. Once the heartbeat resumes, the stall is recorded with its
+    total duration.
+    """
+
+    def __init__(self, threshold=None, interval=None, history=100):
+        self.threshold = threshold or float(os.getenv("LOOP_LAG_THRESHOLD", 0.1))
+        self.interval = interval or float(os.getenv("LOOP_LAG_INTERVAL", 0.05))
+        self.events = deque(maxlen=history)
+        self.stalls = 0
+        self.max_lag = 0.0
+        self.loop = None
+        self._thread_id = None
+        self._beat = None
+
+    def start(self):
+        """Starts monitoring the running loop, must be called from inside it."""
+        if self.loop is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self.loop.create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-lag-monitor", daemon=True).start()
+
+    async def _heartbeat(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        stall = None
+        while True:
+            time.sleep(self.interval)
+            beat = self._beat
+            lag = time.monotonic() - beat - self.interval
+
+            if stall is None and lag > self.threshold:
+                stall = self._capture(beat)
+            elif stall is not None and beat != stall["beat"]:
+                self._record(stall, beat)
+                stall = None
+
+    def _capture(self, beat):
+        frame = sys._current_frames().get(self._thread_id)
+        task = asyncio.current_task(self.loop)
+        return {
+            "beat": beat,
+            "started_at": time.time() - (time.monotonic() - beat - self.interval),
+            "task": task.get_name() if task else None,
+            "coroutine": getattr(task.get_coro(), "__qualname__", None) if task else None,
+            "stack": traceback.format_stack(frame) if frame else [],
+        }
+
+    def _record(self, stall, beat):
+        seconds = beat - stall.pop("beat") - self.interval
+        stall["seconds"] = round(seconds, 3)
+        self.stalls += 1
+        self.max_lag = max(self.max_lag, seconds)
+        self.events.append(stall)
+
+        where = stall["stack"][-1].strip().splitlines()[0] if stall["stack"] else "unknown"
+        log.warning("Event loop blocked for %.3fs by %s", seconds, stall["coroutine"] or "a callback",
+                    extra={"lag_seconds": stall["seconds"], "task": stall["task"], "where": where})
+
+    def report(self):
+        return {
+            "threshold": self.threshold,
+            "stalls": self.stalls,
+            "max_lag": round(self.max_lag, 3),
+            "events": list(self.events),
+        }
+
+
+loop_monitor = LoopLagMonitor()
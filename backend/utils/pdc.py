@@ -1,21 +1,40 @@
 import json
+import logging
 import os
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from langchain_community.document_loaders import PyPDFLoader
-import tempfile
+import requests
+from utils.deadline import Cancelled, DeadlineExceeded
+from utils.shared_cache import shared_cache
+from utils.tenants import get_tenant
+
+
+log = logging.getLogger(__name__)
+
+REPORT_URL = 'https://pdc-appapi.fsmb.org/download/practitioner/report'
+REPORT_TIMEOUT = 120
 
 
 def local_storage_has_key(driver, key):
     return driver.execute_script(f"return localStorage.getItem('{key}') !== null")
 
 
-def login_and_get_token():
-    """Logs into FSMB and extracts the authentication token from local storage."""
+def login_and_get_token(tenant=None, ctx=None):
+    """Logs into FSMB and extracts the authentication token from local storage.
+
+    With a request context every browser wait is capped by the request's
+    remaining time.
+    """
+    tenant = tenant or get_tenant()
+
+    def wait_seconds(cap):
+        return ctx.timeout(cap, stage="FSMB login") if ctx else cap
+
+    # Selenium is only needed for logins, so keep it off the import path
+    from selenium import webdriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
 
     # Set up Chrome options
     chrome_options = Options()
@@ -31,35 +50,36 @@ def login_and_get_token():
     # Initialize WebDriver using context manager to ensure cleanup
     with webdriver.Chrome(options=chrome_options) as driver:
         try:
-            print("Logging into FSMB...")
+            log.info("Logging into FSMB", extra={"tenant": tenant.id})
+            driver.set_page_load_timeout(wait_seconds(60))
             # Step 1: Open FSMB login page
             driver.get("https://pdc-reports.fsmb.org/")
 
-            print("Waiting for login form...")
+            log.debug("Waiting for login form")
             
             # Wait for the login form
-            WebDriverWait(driver, 10).until(
+            WebDriverWait(driver, wait_seconds(10)).until(
                 EC.presence_of_element_located((By.NAME, "Username")))
             
-            print("Filling in login details...")
+            log.debug("Filling in login details")
 
             # Fill in login details
             username_field = driver.find_element(By.NAME, "Username")
             password_field = driver.find_element(By.NAME, "Password")
             
-            print("Logging in...")
+            log.debug("Submitting login form")
 
-            username_field.send_keys(os.getenv("FSMB_USERNAME"))
-            password_field.send_keys(os.getenv("FSMB_PASSWORD"))
+            username_field.send_keys(tenant.env("FSMB_USERNAME"))
+            password_field.send_keys(tenant.env("FSMB_PASSWORD"))
             password_field.send_keys(Keys.RETURN)
             
-            print("Waiting for login to complete...")
+            log.debug("Waiting for login to complete")
 
             # Wait for login to complete by checking URL change or dashboard presence
-            WebDriverWait(driver, 30).until(lambda d: local_storage_has_key(
+            WebDriverWait(driver, wait_seconds(30)).until(lambda d: local_storage_has_key(
                 d, "02d544b8-5953-409e-acac-6e9dc1245c51-b2c_1_signin.47d5d385-8b25-48c4-87bc-719b6e01c6c2-pdcreports.b2clogin.com-idtoken-03c06422-233c-4bba-b656-9f61071e6633----"))
 
-            print("Login successful!")
+            log.info("FSMB login succeeded", extra={"tenant": tenant.id})
             
             # Step 2: Extract local storage data
             raw_local_storage_data = driver.execute_script("""
@@ -72,44 +92,84 @@ def login_and_get_token():
             
             # Parse local storage data
             
-            print("Extracting token...")
+            # Local storage holds the session's tokens, so only key counts are logged
+            log.debug("Extracting token from %d local storage keys", len(raw_local_storage_data))
 
             parsed_local_storage_data = {}
             for key, value in raw_local_storage_data.items():
-                print(f"Key: {key}, Value: {value}")
                 try:
                     # Try to parse as JSON
-                    print(f"Trying to parse JSON: {key}")
                     parsed_local_storage_data[key] = json.loads(value)
                 except (json.JSONDecodeError, TypeError):
                     # Keep as string if not JSON
-                    print(f"Failed to parse JSON: {key}")
                     parsed_local_storage_data[key] = value
 
             for key, value in parsed_local_storage_data.items():
-                print(f"Key: {key}, Value: {value}")
                 if isinstance(value, dict) and value.get("credentialType") == "IdToken":
-                    print("Found token!")
                     token = value.get("secret")
-                    print(str(token))
                     break
 
-        except Exception as e:
-            print(f"Error during FSMB login: {e}")
+            if not token:
+                log.warning("No FSMB id token found in local storage", extra={"tenant": tenant.id})
+
+        except (Cancelled, DeadlineExceeded):
+            raise
+        except Exception:
+            log.exception("FSMB login failed", extra={"tenant": tenant.id})
 
     return token
 
 
-def extract_text_from_pdf_bytes(pdf_bytes):
-    temp_pdf_path = None
-    try:
-        # Create a temporary file without locking (Windows compatible)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_pdf:
-            tmp_pdf.write(pdf_bytes)
-            temp_pdf_path = tmp_pdf.name  # Store temp file path
+def get_pdc_token(tenant=None, ctx=None):
+    """Returns the tenant's FSMB token shared by all workers, logging in only when none is valid."""
+    tenant = tenant or get_tenant()
+    return shared_cache.single_flight(
+        f"pdc_token:{tenant.id}", lambda: login_and_get_token(tenant, ctx),
+        ttl=int(os.getenv("PDC_TOKEN_TTL", 50 * 60)), ctx=ctx)
+
+
+def invalidate_pdc_token(token, tenant=None):
+    """Drops a rejected FSMB token unless another worker already replaced it."""
+    tenant = tenant or get_tenant()
+    shared_cache.compare_and_set(f"pdc_token:{tenant.id}", token, None)
+
+
+def iter_report_chunks(token, rosterEntryId, ctx=None, tenant=None, chunk_size=64 * 1024):
+    """Streams the practitioner report PDF from FSMB without buffering it in memory.
+
+    With a request context the download gets the request's remaining time as
+    its timeout and stops between chunks once the request is cancelled.
+    """
+    tenant = tenant or get_tenant()
+    headers = {
+        'Authorization': f'Bearer {token}',
+        'Content-Type': 'application/json',
+    }
+    data = {
+        "rosterEntryIds": [rosterEntryId],
+        "customerId": tenant.customerId,
+    }
+
+    timeout = ctx.timeout(stage="report download") if ctx else REPORT_TIMEOUT
+    with requests.post(REPORT_URL, headers=headers, json=data, stream=True, timeout=timeout) as response:
+        if response.status_code == 401:
+            invalidate_pdc_token(token, tenant)
+        response.raise_for_status()
+        log.info("Report download started", extra={"rosterEntryId": rosterEntryId, "status": response.status_code})
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if ctx:
+                ctx.check("report download")
+            if chunk:
+                yield chunk
+
+
+def extract_text_from_pdf_file(pdf_path):
+    # The langchain stack is heavy to import, load it on first extraction
+    from langchain_community.document_loaders import PyPDFLoader
 
-        # Use PyPDFLoader with the temp file path
-        loader = PyPDFLoader(temp_pdf_path)
+    try:
+        # Use PyPDFLoader with the file path
+        loader = PyPDFLoader(pdf_path)
         pages = loader.load()
 
         # Combine text from all pages
@@ -118,8 +178,3 @@ def extract_text_from_pdf_bytes(pdf_bytes):
 
     except Exception as e:
         raise Exception(f"Failed to extract text: {e}")
-
-    finally:
-        # Cleanup: Delete the temporary file after processing
-        if temp_pdf_path and os.path.exists(temp_pdf_path):
-            os.remove(temp_pdf_path)
@@ -0,0 +1,107 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from utils.log import job as job_context, log_key
+from utils.deadline import Cancelled
+
+
+log = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """Runs speculative background jobs keyed by what they warm.
+
+    At most max_pending jobs wait for a worker; submitting past that cancels
+    the oldest job that hasn't started yet. Jobs still queued or running
+    after stale_after seconds are cancelled as well, and finished jobs are
+    forgotten after the same delay.
+
+    Jobs submitted with a request context can be stopped while running:
+    cancelling the context makes them stop at their next check. A job
+    submitted with a group supersedes the group's earlier jobs, e.g. a
+    page's prefetch for the practitioner the user moved away from.
+    """
+
+    def __init__(self, workers=None, max_pending=None, stale_after=None):
+        self.max_pending = max_pending or int(os.getenv("PREFETCH_MAX_PENDING", 16))
+        self.stale_after = stale_after or int(os.getenv("PREFETCH_STALE_AFTER", 5 * 60))
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or int(os.getenv("PREFETCH_WORKERS", 2)),
+            thread_name_prefix="prefetch")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cancel(self, key, reason):
+        future, _, ctx, _ = self._jobs[key]
+        if future.done() or (ctx and ctx.cancelled):
+            return
+        if not future.cancel() and ctx:
+            ctx.cancel()
+        log.info("Cancelled %s prefetch", reason, extra={"key": log_key(key)})
+
+    def _prune(self):
+        now = time.time()
+        for key, (future, submitted_at, _, _) in list(self._jobs.items()):
+            if now - submitted_at < self.stale_after:
+                continue
+            self._cancel(key, "stale")
+            if future.done():
+                del self._jobs[key]
+
+        pending = [key for key, (future, _, _, _) in self._jobs.items() if not future.running() and not future.done()]
+        while len(pending) >= self.max_pending:
+            key = pending.pop(0)
+            if self._jobs[key][0].cancel():
+                log.info("Cancelled stale prefetch", extra={"key": log_key(key)})
+                del self._jobs[key]
+
+    def submit(self, key, fn, *args, ctx=None, group=None):
+        """Queues fn(*args) under key unless a live job for key already exists.
+
+        ctx is the context fn checks, so the job can be cancelled once
+        running. Submitting with a group cancels the group's other jobs.
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            live = job and not job[0].cancelled() and not (job[2] and job[2].cancelled)
+            if live and not (job[0].done() and job[0].exception()):
+                return False
+
+            if group is not None:
+                for other, (_, _, _, other_group) in list(self._jobs.items()):
+                    if other_group == group and other != key:
+                        self._cancel(other, "superseded")
+
+            self._prune()
+            self._jobs[key] = (self._executor.submit(self._run, key, fn, *args), time.time(), ctx, group)
+            return True
+
+    def _run(self, key, fn, *args):
+        with job_context(log_key(key)):
+            try:
+                return fn(*args)
+            except Cancelled:
+                log.info("Background job was cancelled")
+                raise
+            except Exception:
+                # Nobody may ever read the future, so this is the only trace of the failure
+                log.exception("Background job failed")
+                raise
+
+    def get(self, key):
+        """Returns the future of an in-flight or finished job for key, if any."""
+        with self._lock:
+            job = self._jobs.get(key)
+        if not job or job[0].cancelled():
+            return None
+        return job[0]
+
+
+prefetcher = Prefetcher()
+
+# CRM index syncs log in by OTP and page through every user, so they get a
+# worker of their own instead of holding up report prefetches
+index_syncs = Prefetcher(workers=1, stale_after=60 * 60)
@@ -0,0 +1,124 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+
+# Leaf frames of threads that are parked waiting for work, not doing any
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+def frame_label(code):
+    # Flamegraph tools split stacks on ";", so keep it out of the labels
+    path = "/".join(code.co_filename.split(os.sep)[-2:])
+    return f"{code.co_name} ({path}:{code.co_firstlineno})".replace(";", ":")
+
+
+def thread_label(name):
+    # Group pool threads, e.g. "asyncio_3" and "asyncio_7" into "asyncio"
+    return re.sub(r"[_-]\d+$", "", name or "thread").replace(";", ":")
+
+
+class SamplingProfiler:
+    """Samples every thread's Python stack at a fixed interval.
+
+    Nothing is hooked into the interpreter, a sampling thread just reads
+    sys._current_frames(), so the overhead is bounded by the interval and
+    nothing runs while no profile is being taken. Profiles come out in the
+    collapsed-stack format read by flamegraph.pl, speedscope and inferno.
+    """
+
+    def __init__(self, interval=None, max_seconds=None):
+        self.interval = interval or float(os.getenv("PROFILE_INTERVAL", 0.01))
+        self.max_seconds = max_seconds or float(os.getenv("PROFILE_MAX_SECONDS", 5 * 60))
+        self._lock = threading.Lock()
+        self._session = None
+
+    @property
+    def active(self):
+        return self._session is not None
+
+    def request_done(self, path):
+        session = self._session
+        if session and (session["path"] is None or session["path"] == path):
+            session["requests"] += 1
+
+    def profile(self, seconds=None, requests=None, path=None):
+        """Samples for the given seconds, or until the next N requests (to path, if given) finish.
+
+        Returns the collapsed stacks and a summary. Raises RuntimeError if a
+        profile is already being taken.
+        """
+        with self._lock:
+            if self._session is not None:
+                raise RuntimeError("A profile is already being taken")
+            self._session = {"path": path, "requests": 0}
+
+        own = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        started = time.monotonic()
+        deadline = started + min(seconds or self.max_seconds, self.max_seconds)
+        try:
+            while time.monotonic() < deadline:
+                if requests and self._session["requests"] >= requests:
+                    break
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own or self._is_idle(frame):
+                        continue
+                    stack = ";".join(reversed(self._walk(frame)))
+                    stacks[f"{thread_label(names.get(ident))};{stack}"] += 1
+                samples += 1
+                time.sleep(self.interval)
+            finished = self._session["requests"]
+        finally:
+            self._session = None
+
+        collapsed = "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+        return collapsed, {
+            "samples": samples,
+            "seconds": round(time.monotonic() - started, 3),
+            "requests": finished,
+        }
+
+    def _walk(self, frame):
+        stack = []
+        while frame is not None:
+            stack.append(frame_label(frame.f_code))
+            frame = frame.f_back
+        return stack
+
+    def _is_idle(self, frame):
+        code = frame.f_code
+        return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+class ProfiledRequests:
+    """ASGI middleware that tells the profiler when a request has fully finished.
+
+    It wraps the whole ASGI call, so streamed responses count once their
+    last event is sent, not when their headers go out.
+    """
+
+    def __init__(self, app, profiler=None):
+        self.app = app
+        self.profiler = profiler or sampling_profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.active:
+            return await self.app(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.profiler.request_done(scope["path"])
+
+
+sampling_profiler = SamplingProfiler()
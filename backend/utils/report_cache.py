@@ -0,0 +1,235 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # Windows, where only one worker is run
+    fcntl = None
+from utils.pdc import iter_report_chunks
+from utils.shared_cache import shared_cache
+from utils.roster import roster_marker
+from utils.tenants import get_tenant
+
+
+log = logging.getLogger(__name__)
+
+
+class ReportCache:
+    """Content-addressed on-disk cache of FSMB practitioner report PDFs.
+
+    Entries are keyed by rosterEntryId plus the roster's last-updated marker,
+    so a report is only downloaded again once FSMB reports a change. Entries
+    without a marker fall back to a TTL. Least recently used entries are
+    evicted once the blobs on disk exceed the size cap.
+
+    The index is re-read under a file lock whenever another worker changed
+    it, so all workers on the host share one cache directory safely. Each
+    tenant gets its own directory and size cap.
+
+    A hit only bumps the blob's mtime, which is the LRU clock, so reads take
+    a shared lock and never rewrite the index. Callers hold on to the path
+    until they have parsed it, so blobs used within the last grace seconds
+    are never deleted; the cache may overshoot its cap until they age out.
+    """
+
+    def __init__(self, tenant=None, directory=None, max_bytes=None, ttl=None):
+        self.tenant = tenant or get_tenant()
+        self.directory = directory or os.path.join(
+            os.getenv("REPORT_CACHE_DIR", os.path.join("TEMP", "report_cache")), self.tenant.id)
+        self.max_bytes = max_bytes or self.tenant.reportCacheMaxBytes or int(
+            os.getenv("REPORT_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+        self.ttl = ttl or int(os.getenv("REPORT_CACHE_TTL", 6 * 60 * 60))
+        self.grace = float(os.getenv("REPORT_CACHE_GRACE", 30 * 60))
+        self._lock = threading.Lock()
+        self._entries = None
+        self._index_stat = None
+
+    @property
+    def blob_dir(self):
+        return os.path.join(self.directory, "blobs")
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, "index.json")
+
+    def blob_path(self, sha):
+        return os.path.join(self.blob_dir, f"{sha}.pdf")
+
+    @contextmanager
+    def _locked(self, shared=False):
+        with self._lock:
+            os.makedirs(self.blob_dir, exist_ok=True)
+            with open(os.path.join(self.directory, ".lock"), "w") as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                try:
+                    yield self._load()
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            stat = os.stat(self.index_path)
+            stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            stat = None
+
+        # The index is replaced atomically on every save, so an unchanged
+        # stat means our parsed copy is current
+        if self._entries is not None and stat == self._index_stat:
+            return self._entries
+
+        try:
+            with open(self.index_path, "r") as file:
+                self._entries = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._entries = {}
+        self._index_stat = stat
+        return self._entries
+
+    def _save(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".json")
+        with os.fdopen(fd, "w") as file:
+            json.dump(self._entries, file)
+        os.replace(tmp_path, self.index_path)
+        stat = os.stat(self.index_path)
+        self._index_stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _last_used(self, sha):
+        try:
+            return os.path.getmtime(self.blob_path(sha))
+        except FileNotFoundError:
+            return None
+
+    def _is_fresh(self, entry):
+        if entry.get("marker") is not None:
+            return True
+        return time.time() - entry["created"] < self.ttl
+
+    def _evict(self, keep):
+        entries = self._entries
+        last_used = {entry["sha"]: self._last_used(entry["sha"]) for entry in entries.values()}
+        in_use_after = time.time() - self.grace
+
+        for key in [key for key, entry in entries.items()
+                    if last_used[entry["sha"]] is None or not self._is_fresh(entry)]:
+            del entries[key]
+
+        sizes = {entry["sha"]: entry["size"] for entry in entries.values()}
+        total = sum(sizes.values())
+        for key in sorted(entries, key=lambda key: last_used[entries[key]["sha"]]):
+            if total <= self.max_bytes:
+                break
+            if key == keep or last_used[entries[key]["sha"]] > in_use_after:
+                continue
+            sha = entries.pop(key)["sha"]
+            if sha in sizes and not any(entry["sha"] == sha for entry in entries.values()):
+                total -= sizes.pop(sha)
+
+        # Remove blobs no entry points to anymore, once no reader can still have
+        # their path, and partial downloads left behind by a crashed worker,
+        # which a live download keeps touching with every chunk
+        referenced = {f"{entry['sha']}.pdf" for entry in entries.values()}
+        for name in os.listdir(self.blob_dir):
+            if not (name.endswith(".pdf") and name not in referenced or name.endswith(".part")):
+                continue
+            path = os.path.join(self.blob_dir, name)
+            try:
+                if os.path.getmtime(path) <= in_use_after:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._locked(shared=True) as entries:
+            blobs = {entry["sha"]: entry["size"] for entry in entries.values()}
+            return {"entries": len(entries), "bytes": sum(blobs.values())}
+
+    def lookup(self, roster):
+        """Returns the cached report path for a roster entry, or None on a miss."""
+        key = cache_key(roster)
+        with self._locked(shared=True) as entries:
+            entry = entries.get(key)
+            if not entry or not self._is_fresh(entry):
+                return None
+            path = self.blob_path(entry["sha"])
+            try:
+                # Marks the blob as recently used, which also protects it from eviction
+                os.utime(path)
+            except FileNotFoundError:
+                return None
+            return path
+
+    def store(self, roster, chunks):
+        """Streams report chunks to disk and records them under the roster's key."""
+        os.makedirs(self.blob_dir, exist_ok=True)
+        key = cache_key(roster)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.blob_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    file.write(chunk)
+            sha = digest.hexdigest()
+            path = self.blob_path(sha)
+
+            now = time.time()
+            with self._locked():
+                os.replace(tmp_path, path)
+                # A new marker supersedes any older report for the same entry
+                prefix = f"{roster['rosterEntryId']}:"
+                for stale in [k for k in self._entries if k.startswith(prefix)]:
+                    del self._entries[stale]
+                self._entries[key] = {
+                    "sha": sha,
+                    "size": size,
+                    "marker": roster_marker(roster),
+                    "created": now,
+                }
+                os.utime(path)
+                self._evict(keep=key)
+                self._save()
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return path
+
+    def get_report(self, token, roster, ctx=None):
+        """Returns a local path to the roster entry's report, downloading it on a miss."""
+        path = self.lookup(roster)
+        if path:
+            log.debug("Report cache hit", extra={"rosterEntryId": roster['rosterEntryId']})
+            return path
+
+        # Concurrent requests for the same report wait for a single download
+        with shared_cache.lease(f"report:{self.tenant.id}:{cache_key(roster)}", timeout=ctx.timeout() if ctx else 300):
+            path = self.lookup(roster)
+            if path:
+                log.debug("Report was downloaded by a concurrent request", extra={"rosterEntryId": roster['rosterEntryId']})
+                return path
+
+            log.info("Report cache miss, downloading", extra={"rosterEntryId": roster['rosterEntryId']})
+            return self.store(roster, iter_report_chunks(token, roster['rosterEntryId'], ctx, self.tenant))
+
+
+def cache_key(roster):
+    return f"{roster['rosterEntryId']}:{roster_marker(roster) or ''}"
+
+
+report_caches = {}
+
+
+def report_cache_for(tenant):
+    """Returns the tenant's report cache, creating it on first use."""
+    if tenant.id not in report_caches:
+        report_caches[tenant.id] = ReportCache(tenant)
+    return report_caches[tenant.id]
@@ -0,0 +1,239 @@
+import codecs
+import json
+import sys
+
+
+# Roster fields FSMB uses to flag that a practitioner's report has changed
+MARKER_KEYS = (
+    "lastUpdatedDate",
+    "lastModifiedDate",
+    "lastUpdated",
+    "modifiedDate",
+    "updatedDate",
+)
+
+# The only roster fields the service reads
+ROSTER_FIELDS = (
+    "rosterEntryId",
+    "firstName",
+    "lastName",
+    "middleName",
+    "suffix",
+    "displayBirthDate",
+)
+
+
+def change_name(data):
+    name = ""
+    if data['lastName']:
+        name += data['lastName'] + ', '
+    if data['firstName']:
+        name += data['firstName'] + ' '
+    if data['middleName']:
+        name += data['middleName']
+    if data['suffix']:
+        name += ', ' + data['suffix']
+
+    return name
+
+
+def roster_marker(roster):
+    """Returns the roster entry's last-updated marker, if FSMB sent one."""
+    if isinstance(roster, RosterEntry):
+        return roster.marker
+    for key in MARKER_KEYS:
+        if roster.get(key):
+            return str(roster[key])
+    return None
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class RosterEntry:
+    """One practitioner, holding only the roster fields the service reads.
+
+    Supports roster['field'] access so callers written against the raw FSMB
+    dicts keep working.
+    """
+
+    __slots__ = ROSTER_FIELDS + ("name", "marker")
+
+    def __init__(self, rosterEntryId, firstName, lastName, middleName, suffix,
+                 displayBirthDate, name=None, marker=None):
+        self.rosterEntryId = rosterEntryId
+        self.firstName = firstName
+        self.lastName = lastName
+        # Short and highly repetitive, so share one copy of each value
+        self.middleName = _intern(middleName)
+        self.suffix = _intern(suffix)
+        self.displayBirthDate = _intern(displayBirthDate)
+        self.name = name
+        self.marker = _intern(marker)
+
+    @classmethod
+    def from_item(cls, item):
+        return cls(
+            *(item.get(field) for field in ROSTER_FIELDS),
+            name=change_name(item),
+            marker=roster_marker(item),
+        )
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def match_name(self):
+        return f"{self.lastName}, {self.firstName} {self.middleName}".strip()
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class RosterSnapshot:
+    """Immutable roster shared by reference across requests.
+
+    Serialises to struct-of-arrays columns, which is what the shared cache
+    stores, and indexes entries by id and by the name/birth date the
+    frontend submits.
+    """
+
+    __slots__ = ("entries", "_by_id", "_by_name")
+
+    def __init__(self, entries):
+        self.entries = tuple(entries)
+        self._by_id = {str(entry.rosterEntryId): entry for entry in self.entries}
+        self._by_name = {}
+        for entry in self.entries:
+            self._by_name.setdefault((entry.match_name(), entry.displayBirthDate), entry)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, rosterEntryId):
+        return self._by_id.get(str(rosterEntryId))
+
+    def find(self, username, birth_date):
+        return self._by_name.get((username, birth_date))
+
+    def to_columns(self):
+        return {
+            field: [getattr(entry, field) for entry in self.entries]
+            for field in RosterEntry.__slots__
+        }
+
+    @classmethod
+    def from_columns(cls, columns):
+        fields = RosterEntry.__slots__
+        return cls(RosterEntry(*row) for row in zip(*(columns[field] for field in fields)))
+
+
+def iter_json_array(chunks, key):
+    """Yields the objects of the first array under key from a stream of JSON bytes.
+
+    Only one item is decoded at a time, so the full response body is never
+    held in memory. Items must be JSON objects, which is what lets a failed
+    decode be told apart from an item split across chunks.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    pos = 0
+
+    def read_more():
+        nonlocal buffer, pos
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError(f"Unexpected end of JSON while reading '{key}'")
+        buffer = buffer[pos:] + utf8.decode(chunk)
+        pos = 0
+
+    # Find the start of the array
+    marker = f'"{key}"'
+    while True:
+        start = buffer.find(marker, pos)
+        if start != -1:
+            bracket = buffer.find("[", start + len(marker))
+            if bracket != -1:
+                pos = bracket + 1
+                break
+        # Keep the tail in case the marker straddles two chunks
+        pos = max(0, len(buffer) - len(marker) - 16)
+        read_more()
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(buffer):
+            read_more()
+            continue
+        if buffer[pos] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # The item is split across chunks
+            read_more()
+            continue
+        pos = end
+        yield item
+
+
+def parse_roster(chunks):
+    """Builds a roster snapshot from a streamed FSMB roster response."""
+    return RosterSnapshot(RosterEntry.from_item(item) for item in iter_json_array(chunks, "items"))
+
+
+if __name__ == "__main__":
+    # Benchmark: memory per practitioner for raw FSMB dicts vs the snapshot
+    import random
+    import tracemalloc
+
+    def sample_item(i):
+        return {
+            "rosterEntryId": 1000000 + i,
+            "customerId": 7881,
+            "firstName": random.choice(["John", "Maria", "Wei", "Aisha"]) + str(i),
+            "lastName": random.choice(["Smith", "Garcia", "Chen", "Khan"]) + str(i),
+            "middleName": random.choice(["A", "B", "", None]),
+            "suffix": random.choice([None, "Jr", "MD"]),
+            "displayBirthDate": f"{random.randint(1, 12):02d}/{random.randint(1, 28):02d}/{random.randint(1950, 1995)}",
+            "birthDate": "1970-01-01T00:00:00",
+            "fid": str(900000000 + i),
+            "npi": str(1000000000 + i),
+            "profession": random.choice(["MD", "DO", "PA", "NP"]),
+            "state": random.choice(["TEXAS", "OHIO", "IOWA"]),
+            "status": "Active",
+            "lastUpdatedDate": "2024-12-05T00:00:00",
+            "notes": None,
+        }
+
+    count = 10000
+    body = json.dumps({"items": [sample_item(i) for i in range(count)], "totalCount": count}).encode()
+    chunks = [body[i:i + 64 * 1024] for i in range(0, len(body), 64 * 1024)]
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    items = json.loads(body)["items"]
+    for item in items:
+        item["name"] = change_name(item)
+    dict_bytes = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, "filename"))
+    del items
+
+    before = tracemalloc.take_snapshot()
+    snapshot = parse_roster(chunks)
+    snapshot_bytes = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, "filename"))
+    tracemalloc.stop()
+
+    print(f"dicts:    {dict_bytes / count:8.0f} bytes per practitioner")
+    print(f"snapshot: {snapshot_bytes / count:8.0f} bytes per practitioner")
@@ -0,0 +1,131 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class FairScheduler:
+    """Hands out upstream-work slots fairly between tenants.
+
+    At most max_slots jobs run at once, and each tenant at most its own
+    limit. When a slot frees up, waiting interactive jobs go first, then
+    batch jobs, and within each class tenants take turns. A tenant running
+    a 5k-provider export therefore queues behind itself, not in front of
+    another tenant's onboarding.
+
+    Waiters give up once their request context is cancelled or past its
+    deadline. run_async() waits on the scheduler's own threads, so a
+    backlog never ties up the default executor used by asyncio.to_thread.
+    """
+
+    def __init__(self, max_slots=None, threads=None):
+        self.max_slots = max_slots or int(os.getenv("MAX_UPSTREAM_CONCURRENCY", 8))
+        self._executor = ThreadPoolExecutor(
+            max_workers=threads or int(os.getenv("SCHEDULER_THREADS", 64)),
+            thread_name_prefix="scheduler")
+        self._cond = threading.Condition()
+        self._running = defaultdict(int)
+        self._waiting = {True: deque(), False: deque()}
+        self._turns = deque()
+        self._limits = {}
+        self._metrics = defaultdict(lambda: {
+            "running": 0,
+            "waiting": 0,
+            "completed": 0,
+            "failed": 0,
+            "abandoned": 0,
+            "wait_seconds": 0.0,
+            "run_seconds": 0.0,
+        })
+
+    def _next_ticket(self, limits):
+        if sum(self._running.values()) >= self.max_slots:
+            return None
+        for interactive in (True, False):
+            queue = self._waiting[interactive]
+            eligible = [ticket for ticket in queue if self._running[ticket[0]] < limits[ticket[0]]]
+            if not eligible:
+                continue
+            # The tenant that went longest without a slot goes next
+            tenants = [ticket[0] for ticket in eligible]
+            fresh = [t for t in tenants if t not in self._turns]
+            tenant = fresh[0] if fresh else next(t for t in self._turns if t in tenants)
+            return next(ticket for ticket in eligible if ticket[0] == tenant)
+        return None
+
+    @contextmanager
+    def slot(self, tenant, interactive=True, ctx=None):
+        """Blocks until the tenant may start one more upstream job.
+
+        With a request context, raises Cancelled or DeadlineExceeded instead
+        of waiting past the request's lifetime.
+        """
+        ticket = (tenant.id, object())
+        metrics = self._metrics[tenant.id]
+        started = time.monotonic()
+
+        with self._cond:
+            self._limits[tenant.id] = tenant.maxConcurrency
+            self._waiting[interactive].append(ticket)
+            metrics["waiting"] += 1
+            try:
+                while self._next_ticket(self._limits) is not ticket:
+                    if ctx:
+                        ctx.check("upstream slot")
+                        # Cancelling ctx doesn't notify us, so wake up to check it
+                        self._cond.wait(min(ctx.remaining(), 1.0))
+                    else:
+                        self._cond.wait()
+            except BaseException:
+                self._waiting[interactive].remove(ticket)
+                metrics["waiting"] -= 1
+                metrics["abandoned"] += 1
+                self._cond.notify_all()
+                raise
+            self._waiting[interactive].remove(ticket)
+            self._running[tenant.id] += 1
+            if tenant.id in self._turns:
+                self._turns.remove(tenant.id)
+            self._turns.append(tenant.id)
+            metrics["waiting"] -= 1
+            metrics["running"] += 1
+            metrics["wait_seconds"] += time.monotonic() - started
+            # Another waiter may be eligible for a slot that is still free
+            self._cond.notify_all()
+
+        started = time.monotonic()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            with self._cond:
+                self._running[tenant.id] -= 1
+                metrics["running"] -= 1
+                metrics["failed" if failed else "completed"] += 1
+                metrics["run_seconds"] += time.monotonic() - started
+                self._cond.notify_all()
+
+    def run(self, tenant, interactive, ctx, fn, *args):
+        """Runs fn(*args) inside a slot."""
+        with self.slot(tenant, interactive, ctx):
+            return fn(*args)
+
+    async def run_async(self, tenant, interactive, ctx, fn, *args):
+        """Runs fn(*args) inside a slot on the scheduler's threads, keeping the caller's context."""
+        call = functools.partial(contextvars.copy_context().run, self.run, tenant, interactive, ctx, fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    def metrics(self):
+        with self._cond:
+            return {tenant: dict(values) for tenant, values in self._metrics.items()}
+
+
+scheduler = FairScheduler()
@@ -0,0 +1,238 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+class SharedCache:
+    """Key/value cache shared by every uvicorn worker on the host.
+
+    Backed by SQLite in WAL mode so readers never block the writer. Values are
+    stored as JSON with a TTL and a random version. Keys read with memo=True,
+    like the roster, keep a decoded copy in memory that is only re-read once
+    another worker replaced it and dropped once it expires. A lease table provides cross-process single-flight, so only
+    one worker logs in or downloads the roster while the others wait for it.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv(
+            "SHARED_CACHE_PATH", os.path.join("TEMP", "shared_cache.db"))
+        self._local = threading.local()
+        self._memo = {}
+        self._memo_lock = threading.Lock()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    key TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, loads=None, memo=False):
+        """Returns the cached value for key, or None if missing or expired.
+
+        loads, if given, turns the decoded JSON into the object callers want.
+        With memo, its result is kept in memory until the key changes or
+        expires; only a few large, hot keys should opt in, since every
+        memoised value stays resident in each worker.
+        """
+        if not memo:
+            row = self._connect().execute(
+                "SELECT value FROM cache WHERE key = ? AND expires_at > ?",
+                (key, time.time())).fetchone()
+            if row is None:
+                return None
+            value = json.loads(row[0])
+            return loads(value) if loads else value
+
+        row = self._connect().execute(
+            "SELECT version FROM cache WHERE key = ? AND expires_at > ?",
+            (key, time.time())).fetchone()
+        if row is None:
+            with self._memo_lock:
+                self._memo.pop(key, None)
+            return None
+
+        with self._memo_lock:
+            cached = self._memo.get(key)
+        if cached and cached[0] == row[0]:
+            return cached[1]
+
+        row = self._connect().execute(
+            "SELECT version, value FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value = json.loads(row[1])
+        if loads:
+            value = loads(value)
+        with self._memo_lock:
+            self._memo[key] = (row[0], value)
+        return value
+
+    def set(self, key, value, ttl):
+        conn = self._connect()
+        conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        conn.execute("""
+            INSERT INTO cache (key, value, version, expires_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                value = excluded.value,
+                version = excluded.version,
+                expires_at = excluded.expires_at
+        """, (key, json.dumps(value), uuid.uuid4().hex, time.time() + ttl))
+
+    def set_many(self, items, ttl):
+        """Writes several keys in one transaction."""
+        conn = self._connect()
+        expires_at = time.time() + ttl
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("""
+                INSERT OR REPLACE INTO cache (key, value, version, expires_at)
+                VALUES (?, ?, ?, ?)
+            """, [(key, json.dumps(value), uuid.uuid4().hex, expires_at) for key, value in items.items()])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def compare_and_set(self, key, expected, value, ttl=0):
+        """Atomically replaces key only if it still holds expected.
+
+        Passing value=None deletes the key, which is how a worker drops a token
+        that upstream rejected without clobbering one another worker already
+        refreshed.
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND expires_at > ?",
+                (key, time.time())).fetchone()
+            current = json.loads(row[0]) if row else None
+            if current != expected:
+                conn.execute("ROLLBACK")
+                return False
+            if value is None:
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            else:
+                conn.execute("""
+                    INSERT OR REPLACE INTO cache (key, value, version, expires_at)
+                    VALUES (?, ?, ?, ?)
+                """, (key, json.dumps(value), uuid.uuid4().hex, time.time() + ttl))
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _acquire(self, key, owner, lease):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM leases WHERE key = ? AND expires_at <= ?", (key, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)",
+                (key, owner, now + lease))
+            conn.execute("COMMIT")
+            return cursor.rowcount == 1
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _release(self, key, owner):
+        self._connect().execute(
+            "DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+
+    @contextmanager
+    def lease(self, key, timeout=300, poll_interval=0.25):
+        """Holds a cross-process lease on key, waiting for the current holder to release it."""
+        owner = f"{os.getpid()}:{threading.get_ident()}:{uuid.uuid4().hex}"
+        deadline = time.time() + timeout
+        while not self._acquire(key, owner, timeout):
+            if time.time() > deadline:
+                raise TimeoutError(f"Timed out waiting for {key}")
+            time.sleep(poll_interval)
+        try:
+            yield
+        finally:
+            self._release(key, owner)
+
+    def single_flight(self, key, compute, ttl, lease=300, poll_interval=0.25, loads=None, dumps=None, memo=False,
+                      ctx=None):
+        """Returns the cached value for key, computing it in at most one process at a time.
+
+        The worker that wins the lease runs compute() and stores its result;
+        every other caller polls until the value shows up or the lease expires.
+        None results are never cached, so a failed login is retried by the next
+        waiter instead of being shared. dumps and loads convert values that
+        are not plain JSON on the way in and out. With a request context,
+        waiting for another worker stops once the request is cancelled or
+        out of time.
+        """
+        value = self.get(key, loads, memo)
+        if value is not None:
+            return value
+
+        owner = f"{os.getpid()}:{threading.get_ident()}:{uuid.uuid4().hex}"
+        deadline = time.time() + lease
+        while True:
+            if self._acquire(key, owner, lease):
+                try:
+                    value = self.get(key, loads, memo)
+                    if value is None:
+                        value = compute()
+                        if value is not None:
+                            self.set(key, dumps(value) if dumps else value, ttl)
+                    return value
+                finally:
+                    self._release(key, owner)
+
+            time.sleep(poll_interval)
+            if ctx:
+                ctx.check("shared cache wait")
+            value = self.get(key, loads, memo)
+            if value is not None:
+                return value
+            if time.time() > deadline:
+                raise TimeoutError(f"Timed out waiting for {key}")
+
+    def status(self, keys):
+        """Reports which keys are currently cached, for health checks."""
+        conn = self._connect()
+        now = time.time()
+        return {
+            key: conn.execute(
+                "SELECT 1 FROM cache WHERE key = ? AND expires_at > ?", (key, now)).fetchone() is not None
+            for key in keys
+        }
+
+
+shared_cache = SharedCache()
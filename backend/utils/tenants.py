@@ -0,0 +1,48 @@
+import json
+import os
+from functools import lru_cache
+from typing import Dict, Optional
+from pydantic import BaseModel, Field
+
+
+class Tenant(BaseModel):
+    """One customer account served by this deployment.
+
+    Credentials are not stored in the tenants file, they are read from the
+    environment with the tenant's prefix, e.g. ACME_FSMB_USERNAME.
+    """
+    id: str
+    customerId: int
+    envPrefix: str = ""
+    maxConcurrency: int = 4
+    exportConcurrency: int = Field(default_factory=lambda: int(os.getenv("EXPORT_CONCURRENCY", 4)))
+    reportCacheMaxBytes: Optional[int] = None
+
+    def env(self, name):
+        return os.getenv(f"{self.envPrefix}{name}")
+
+
+DEFAULT_TENANT_ID = "default"
+
+
+@lru_cache(maxsize=None)
+def load_tenants() -> Dict[str, Tenant]:
+    """Reads tenants from TENANTS_FILE, falling back to a single tenant configured by the plain env vars."""
+    path = os.getenv("TENANTS_FILE")
+    if not path:
+        tenant = Tenant(id=DEFAULT_TENANT_ID, customerId=int(os.getenv("FSMB_CUSTOMER_ID", 7881)))
+        return {tenant.id: tenant}
+
+    with open(path, "r") as file:
+        tenants = [Tenant(**tenant) for tenant in json.load(file)]
+    return {tenant.id: tenant for tenant in tenants}
+
+
+def get_tenant(tenant_id=None) -> Tenant:
+    """Returns the tenant with the given id, or the default one. Raises KeyError if unknown."""
+    tenants = load_tenants()
+    if tenant_id is None:
+        if DEFAULT_TENANT_ID in tenants:
+            return tenants[DEFAULT_TENANT_ID]
+        return next(iter(tenants.values()))
+    return tenants[tenant_id]
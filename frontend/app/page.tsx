@@ -1,6 +1,6 @@
 "use client"
 
-import { useEffect, useState } from "react"
+import { useEffect, useRef, useState } from "react"
 import { useTokenManager } from "@/hooks/useTokenManager"
 import { LicenseEntryForm } from "@/components/LicenseEntryForm"
 import { ProgressPopup } from "@/components/ProgressPopup"
@@ -17,6 +17,9 @@ export default function Home() {
   const [message, setMessage] = useState<string>("")
   const [isCreatingLicense, setIsCreatingLicense] = useState(false)
   const [progressData, setProgressData] = useState<ProgressData | null>(null)
+  const lastPrefetch = useRef<string | null>(null)
+  // Lets the backend cancel this page's previous prefetch when another practitioner is picked
+  const prefetchClientId = useRef(Math.random().toString(36).slice(2))
 
   useEffect(() => {
     if (isTokenLoading) {
@@ -28,6 +31,26 @@ export default function Home() {
     }
   }, [isTokenLoading, tokenError, tokens])
 
+  // Fire-and-forget, the backend warms the report while the rest of the form is filled in
+  const handlePractitionerSelected = (username: string, birthDate: string) => {
+    const key = `${username}|${birthDate}`
+    if (!tokens || lastPrefetch.current === key) return
+    lastPrefetch.current = key
+
+    fetch(`${process.env.NEXT_PUBLIC_API_URL}/prefetch`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({
+        username,
+        birth_date: birthDate,
+        pdcToken: tokens.pdcToken,
+        clientId: prefetchClientId.current,
+      }),
+    }).catch(() => {})
+  }
+
   const handleCreateLicenseEntry = async (formData: FormData) => {
     if (!tokens) {
       setMessage("Error: No tokens available")
@@ -95,7 +118,13 @@ export default function Home() {
     <main className="flex min-h-screen flex-col items-center justify-center p-24">
       <h1 className="text-4xl font-bold mb-8">License Entry Creator</h1>
       <div className="text-xl mb-4">{message}</div>
-      {tokens && <LicenseEntryForm onSubmit={handleCreateLicenseEntry} isLoading={isCreatingLicense} />}
+      {tokens && (
+        <LicenseEntryForm
+          onSubmit={handleCreateLicenseEntry}
+          onPractitionerSelected={handlePractitionerSelected}
+          isLoading={isCreatingLicense}
+        />
+      )}
       <ProgressPopup isOpen={isCreatingLicense} progressData={progressData} />
     </main>
   )
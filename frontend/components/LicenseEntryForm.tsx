@@ -1,31 +1,46 @@
-import type { FormEvent } from "react"
+import type { FocusEvent, FormEvent } from "react"
 import { Button } from "@/components/ui/button"
 import { Input } from "@/components/ui/input"
 import { Label } from "@/components/ui/label"
 
 interface LicenseEntryFormProps {
   onSubmit: (formData: FormData) => void
+  onPractitionerSelected?: (username: string, birthDate: string) => void
   isLoading: boolean
 }
 
-export function LicenseEntryForm({ onSubmit, isLoading }: LicenseEntryFormProps) {
+// Convert the date to MM/DD/YYYY format
+function formatBirthDate(birthDateInput: string) {
+  const date = new Date(birthDateInput)
+  return `${(date.getMonth() + 1).toString().padStart(2, "0")}/${date.getDate().toString().padStart(2, "0")}/${date.getFullYear()}`
+}
+
+export function LicenseEntryForm({ onSubmit, onPractitionerSelected, isLoading }: LicenseEntryFormProps) {
   const handleSubmit = (event: FormEvent<HTMLFormElement>) => {
     event.preventDefault()
     const formData = new FormData(event.currentTarget)
 
-    // Convert the date to MM/DD/YYYY format
     const birthDateInput = formData.get("birth_date") as string
     if (birthDateInput) {
-      const date = new Date(birthDateInput)
-      const formattedDate = `${(date.getMonth() + 1).toString().padStart(2, "0")}/${date.getDate().toString().padStart(2, "0")}/${date.getFullYear()}`
-      formData.set("birth_date", formattedDate)
+      formData.set("birth_date", formatBirthDate(birthDateInput))
     }
 
     onSubmit(formData)
   }
 
+  // Once the practitioner is identified, let the backend start on their report
+  const handleBlur = (event: FocusEvent<HTMLFormElement>) => {
+    if (!onPractitionerSelected) return
+    const formData = new FormData(event.currentTarget)
+    const username = formData.get("username") as string
+    const birthDateInput = formData.get("birth_date") as string
+    if (username && birthDateInput) {
+      onPractitionerSelected(username, formatBirthDate(birthDateInput))
+    }
+  }
+
   return (
-    <form onSubmit={handleSubmit} className="space-y-4 w-full max-w-md">
+    <form onSubmit={handleSubmit} onBlur={handleBlur} className="space-y-4 w-full max-w-md">
       <div>
         <Label htmlFor="username">Username</Label>
         <Input id="username" name="username" required />